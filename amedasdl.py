@@ -1,9 +1,10 @@
 import sys
 import argparse
-from dateutil.relativedelta import relativedelta
+import amedasdl_core
+from amedasdl_core import AdaptiveRateLimiter, AmedasError
 from amedasdl_adv import AMeDAS, AMeDASNode, AmedasDataType
-import datetime
-import typing
+from amedasdl_plan import parse_date, plan
+from amedasdl_writer import WriterSet, save_page
 
 __author__ = 'customtea (https://github.com/customtea/)'
 __version__ = '0.1.0'
@@ -13,30 +14,6 @@ def version():
 
 
 
-def datetime_range(start: datetime.datetime, stop: datetime.datetime, step: relativedelta = relativedelta(days=1)) -> typing.Iterator[datetime.datetime]:
-    """ datetime型を1日ずつ進める
-    for文でrangeの代わりに使う事ができる
-
-    Parameters
-    ----------
-    start : dt.datetime
-        最初の日付
-    stop : dt.datetime
-        最後の日付
-    step : relativedelta, optional
-        進める時間数日数, by default relativedelta(days=1)
-
-    Yields
-    -------
-    Iterator[tp.Iterator[dt.datetime]]
-        [description]
-    """
-    current = start
-    while current < stop:
-        yield current
-        current += step
-
-
 def getOption():
     parser = argparse.ArgumentParser(
         description="""
@@ -75,7 +52,20 @@ Notes:
                                         type=str,
                                         metavar="Output Format",
                                         default="csv",
-                                        help="出力形式 [csv, html]")
+                                        help="出力形式 [csv, html, csvbulk, jsonl, parquet, sqlite] カンマ区切り（スペース不可）で複数指定可能")
+    output_format_group.add_argument("--bulk",
+                                        action="store_true",
+                                        default=False,
+                                        help="csv出力時に期間全体を観測地点・データ種類ごとに1ファイルへまとめる")
+    output_format_group.add_argument("--gzip",
+                                        action="store_true",
+                                        default=False,
+                                        help="--bulk 出力をgzip圧縮する")
+    output_format_group.add_argument("--flush",
+                                        type=int,
+                                        metavar="Rows",
+                                        default=0,
+                                        help="--bulk 出力を指定行数ごとにフラッシュする 0は終了時のみ")
 
     data_type_group = parser.add_argument_group("Data Type Group")
     data_type_group.add_argument("-t", "--dtype",
@@ -95,6 +85,27 @@ Notes:
                         metavar="EndDate",
                         default=None,
                         help='終了日時  YYYYMMDD形式')
+    parser.add_argument('-j','--job',
+                        type=str,
+                        metavar="JobSpec",
+                        default=None,
+                        help='ジョブ定義ファイル（json, toml, yaml）に従って複数地点・複数種類をまとめて取得する')
+    record_group = parser.add_mutually_exclusive_group()
+    record_group.add_argument('--record',
+                        type=str,
+                        metavar="RecordDir",
+                        default=None,
+                        help='取得したページを記録する')
+    record_group.add_argument('--replay',
+                        type=str,
+                        metavar="RecordDir",
+                        default=None,
+                        help='記録したページを使い，サイトにアクセスしない')
+    parser.add_argument('--max-rate',
+                        type=float,
+                        metavar="Request/sec",
+                        default=None,
+                        help='応答時間とエラー率を見てリクエスト頻度を自動調整する 上限のリクエスト数/秒を指定')
     parser.add_argument('-l','--list',
                         action='store_true',
                         default=None,
@@ -117,6 +128,16 @@ if __name__ == '__main__':
     data_types: list[AmedasDataType] = []
     
     opt = getOption()
+    if opt.max_rate:
+        amedasdl_core.rate_limiter = AdaptiveRateLimiter(max_rate=opt.max_rate, max_concurrency=1)
+
+    if opt.record or opt.replay:
+        import amedasdl_replay
+        if opt.record:
+            amedasdl_replay.install(amedasdl_replay.RecordTransport(opt.record))
+        else:
+            amedasdl_replay.install(amedasdl_replay.ReplayTransport(opt.replay))
+
     if opt.list:
         for a in ams.list():
             print(a)
@@ -130,6 +151,10 @@ if __name__ == '__main__':
         a.print_detail()
         sys.exit(0)
     
+    if opt.job:
+        from amedasdl_job import run_spec
+        sys.exit(run_spec(ams, opt.job))
+
     if opt.search:
         try:
             from fuzzyfinder import fuzzyfinder
@@ -202,21 +227,34 @@ if __name__ == '__main__':
                 print(f"Not Support Data Tyep of {t}")
             data_types.append(dtype)
 
-    if opt.start:
-        dt_start = datetime.datetime.strptime(opt.start, "%Y%m%d")
-    else:
-        start = input("StartDate(YYYYMMDD): ")
-        dt_start = datetime.datetime.strptime(start, "%Y%m%d")
-
-    if opt.end:
-        dt_end = datetime.datetime.strptime(opt.end, "%Y%m%d")
-    else:
-        end = input("EndDate(YYYYMMDD)    : ")
-        dt_end = datetime.datetime.strptime(end, "%Y%m%d")
+    try:
+        if opt.start:
+            dt_start = parse_date(opt.start)
+        else:
+            start = input("StartDate(YYYYMMDD): ")
+            dt_start = parse_date(start)
+
+        if opt.end:
+            dt_end = parse_date(opt.end)
+        else:
+            end = input("EndDate(YYYYMMDD)    : ")
+            dt_end = parse_date(end)
+
+        units = plan(locations, data_types, dt_start, dt_end)
+    except AmedasError as e:
+        print(f"[WARNING] {e}")
+        sys.exit(1)
     
-    output_format = opt.output
+    output_formats = opt.output.split(",")
+    if opt.bulk:
+        output_formats = ["csvbulk" if o == "csv" else o for o in output_formats]
+    label = f"{dt_start.strftime('%Y%m%d')}-{dt_end.strftime('%Y%m%d')}"
+    options = {
+        "csvbulk": {"label": label, "gzip": opt.gzip, "flush": opt.flush},
+        "jsonl": {"label": label},
+        "parquet": {"label": label},
+    }
 
-    for dt_current in datetime_range(dt_start, dt_end):
-        for a in locations:
-            for d in data_types:
-                a.save(output_format, d, dt_current)
+    with WriterSet(options) as writer_set:
+        for a, d, dt_current in units:
+            save_page(a, d, dt_current, output_formats, writer_set)
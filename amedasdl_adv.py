@@ -1,7 +1,10 @@
-from amedasdl_core import Amedas, AmedasNode, AmedasDataType
+from amedasdl_core import Amedas, AmedasNode, AmedasDataType, ensure_dir
 import typing
 from bs4 import BeautifulSoup
 import csv
+import gzip
+import threading
+from collections import OrderedDict
 from pathlib import Path
 import datetime
 
@@ -41,28 +44,252 @@ def is_exception_data(raw_data: str):
     return False
 
 
+def row_timestamp(date: datetime.date, cell: str) -> datetime.datetime:
+    """Convert first table column to datetime
+
+    Parameters
+    ----------
+    date : datetime.date
+        page date
+    cell : str
+        "HH:MM" (TENMINUTES) or "H" (HOUR), "24:00" is next day 00:00
+
+    Returns
+    -------
+    datetime.datetime
+        observation time
+    """
+    base = datetime.datetime(date.year, date.month, date.day)
+    if ":" in cell:
+        hour, minute = cell.split(":", 1)
+    else:
+        hour, minute = cell, "0"
+    return base + datetime.timedelta(hours=int(hour), minutes=int(minute))
+
+
+class FileCache():
+    """Bounded set of open files, least recently used is closed first
+
+    opener(path, reopen, *args) opens a file, reopen is True when the path
+    was already opened in this run and closed since, so it must append
+    instead of truncate. Not thread-safe, callers hold their own lock.
+    """
+    def __init__(self, opener: typing.Callable[..., typing.Any], closer: typing.Callable[[typing.Any], None], max_open: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        opener : typing.Callable[..., typing.Any]
+            open file entry, called as opener(path, reopen, *args)
+        closer : typing.Callable[[typing.Any], None]
+            close file entry
+        max_open : int, optional
+            max number of files kept open, by default 64
+        """
+        self.opener = opener
+        self.closer = closer
+        self.max_open = max(1, max_open)
+        self.__files: typing.OrderedDict[Path, typing.Any] = OrderedDict()
+        self.__seen: typing.Set[Path] = set()
+
+    def get(self, path: Path, *args) -> typing.Any:
+        entry = self.__files.get(path)
+        if entry is not None:
+            self.__files.move_to_end(path)
+            return entry
+        if len(self.__files) >= self.max_open:
+            _, old = self.__files.popitem(last=False)
+            self.closer(old)
+        ensure_dir(path.parent)
+        entry = self.opener(path, path in self.__seen, *args)
+        self.__seen.add(path)
+        self.__files[path] = entry
+        return entry
+
+    def values(self) -> typing.List[typing.Any]:
+        return list(self.__files.values())
+
+    def close(self) -> None:
+        for entry in self.__files.values():
+            self.closer(entry)
+        self.__files.clear()
+
+
+class CsvBulkWriter():
+    """Consolidated CSV Writer
+
+    Append whole date range into one file per station and dtype.
+    """
+    def __init__(self, label: str, compress: bool = False, flush_rows: int = 0, buffering: int = 1 << 20, max_open: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        label : str
+            file name suffix (ex. date range "20230101-20230201")
+        compress : bool, optional
+            gzip output, by default False
+        flush_rows : int, optional
+            flush each file after this many rows, 0 is flush only at close, by default 0
+        buffering : int, optional
+            write buffer size, by default 1MiB
+        max_open : int, optional
+            max number of files kept open, by default 64
+        """
+        self.label = label
+        self.compress = compress
+        self.flush_rows = flush_rows
+        self.buffering = buffering
+        self.__files = FileCache(self.__open, lambda entry: entry[0].close(), max_open)
+        self.__lock = threading.Lock()
+
+    def gen_filepath(self, node: AmedasNode, dtype: AmedasDataType) -> Path:
+        """generate consolidated file path
+
+        Parameters
+        ----------
+        node : AmedasNode
+            node
+        dtype : AmedasDataType
+            Data Type
+
+        Returns
+        -------
+        pathlib.Path
+            file path
+        """
+        filename = f"{node.block_no}_{dtype.name}_{self.label}.csv"
+        if self.compress:
+            filename += ".gz"
+        return node.gen_rootpath() / filename
+
+    def __open(self, path: Path, reopen: bool, header: typing.List[str]) -> list:
+        # truncate on first open in this run, append after reopen
+        mode = "at" if reopen else "wt"
+        if self.compress:
+            f = gzip.open(path, mode, encoding="utf-8", newline="")
+        else:
+            f = open(path, mode, buffering=self.buffering, encoding="utf-8", newline="")
+        writer = csv.writer(f)
+        if not reopen:
+            writer.writerow(["日時"] + header)
+        return [f, writer, 0]
+
+    def write(self, node: AmedasNode, dtype: AmedasDataType, date: datetime.date, header: typing.List[str], table: typing.List[typing.List[str]]) -> None:
+        """append one page table
+
+        Parameters
+        ----------
+        node : AmedasNode
+            node
+        dtype : AmedasDataType
+            Data Type
+        date : datetime.date
+            page date
+        header : typing.List[str]
+            csv header
+        table : typing.List[typing.List[str]]
+            parsed table
+        """
+        rows = []
+        for row in table:
+            if len(row) == 0:
+                continue
+            ts = row_timestamp(date, row[0])
+            rows.append([ts.strftime("%Y-%m-%d %H:%M")] + row)
+        with self.__lock:
+            entry = self.__files.get(self.gen_filepath(node, dtype), header)
+            f, writer, _ = entry
+            writer.writerows(rows)
+            entry[2] += len(rows)
+            if self.flush_rows > 0 and entry[2] >= self.flush_rows:
+                f.flush()
+                entry[2] = 0
+
+    def flush(self) -> None:
+        with self.__lock:
+            for f, _, _ in self.__files.values():
+                f.flush()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__files.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class AMeDASNode(AmedasNode):
     def __check_support_dtype(self, dtype: AmedasDataType):
         return dtype is AmedasDataType.TENMINUTES or dtype is AmedasDataType.HOUR
     
-    def save(self, outtype:str, dtype: AmedasDataType, date: datetime.date):
-        if outtype == "csv":
-            self.save_csv(dtype, date)
-        elif outtype == "html":
-            self.save_html(dtype, date)
-        else:
-            print(f"Not Support Output Format {outtype}")
+    def save(self, outtype: typing.Union[str, typing.Iterable[str]], dtype: AmedasDataType, date: datetime.date, writer_set=None):
+        """download once and save to every output format
 
-    def save_csv(self, dtype: AmedasDataType, date: datetime.date):
-        if not self.__check_support_dtype(dtype):
-            print(f"Not Support {dtype.name} for csv output")
+        Outputs which write one file for the whole run (csvbulk, jsonl,
+        parquet) need writer_set opened by the caller and shared by every
+        page, without it only per-page outputs (csv, html, sqlite) are saved.
+
+        Parameters
+        ----------
+        outtype : typing.Union[str, typing.Iterable[str]]
+            output format names, comma separated or list (see amedasdl_writer)
+        dtype : AmedasDataType
+            Data Type
+        date : datetime.date
+            Target Date
+        writer_set : amedasdl_writer.WriterSet, optional
+            writers shared by every page of the run, by default None
+        """
+        from amedasdl_writer import WriterSet, save_page, writer_class
+        outputs = outtype.split(",") if isinstance(outtype, str) else list(outtype)
+        if writer_set is not None:
+            save_page(self, dtype, date, outputs, writer_set)
             return
-        dpath = self.gen_savepath(date)
-        filename = Path(self.gen_filename(dtype, date) + ".csv")
-        dpath.mkdir(parents=True, exist_ok=True)
-        savepath = dpath / filename
+        per_page = []
+        for o in outputs:
+            cls = writer_class(o)
+            if cls is not None and cls.per_run:
+                print(f"{o} output needs a WriterSet shared by every page, use save(..., writer_set=WriterSet())")
+            else:
+                per_page.append(o)
+        with WriterSet() as writer_set:
+            save_page(self, dtype, date, per_page, writer_set)
+
+    def fetch_table(self, dtype: AmedasDataType, date: datetime.date) -> typing.Tuple[typing.List[str], typing.List[typing.List[str]]]:
+        """download and parse one page
+
+        Parameters
+        ----------
+        dtype : AmedasDataType
+            Data Type
+        date : datetime.date
+            Target Date
+
+        Returns
+        -------
+        typing.Tuple[typing.List[str], typing.List[typing.List[str]]]
+            csv header and table
+        """
         html = self.download(dtype, date)
-        
+        return self.parse_page(dtype, html)
+
+    def parse_page(self, dtype: AmedasDataType, html: str) -> typing.Tuple[typing.List[str], typing.List[typing.List[str]]]:
+        """parse downloaded page
+
+        Parameters
+        ----------
+        dtype : AmedasDataType
+            Data Type
+        html : str
+            HTML text
+
+        Returns
+        -------
+        typing.Tuple[typing.List[str], typing.List[typing.List[str]]]
+            csv header and table
+        """
         tb_name = table_infos[dtype]["tablename"]
         tb_numer = table_infos[dtype]["tablenum"]
         headernum = parse_header_nums[dtype][self.obstype]
@@ -70,12 +297,24 @@ class AMeDASNode(AmedasNode):
         if len(header) == 0:
             print("[Info] This Header Type is not Implement")
         table = self.parse_table_to_list(html, tb_name, headernum, tb_numer)
+        return header, table
 
-        csv_file = open(savepath, 'wt', newline = '', encoding = 'utf-8')
-        table.insert(0, header)
-        csv_write = csv.writer(csv_file)
-        csv_write.writerows(table)
-        csv_file.close()
+    def save_csv(self, dtype: AmedasDataType, date: datetime.date):
+        if not self.__check_support_dtype(dtype):
+            print(f"Not Support {dtype.name} for csv output")
+            return
+        header, table = self.fetch_table(dtype, date)
+        self.write_csv(dtype, date, header, table)
+
+    def write_csv(self, dtype: AmedasDataType, date: datetime.date, header: typing.List[str], table: typing.List[typing.List[str]]):
+        dpath = self.gen_savepath(date)
+        filename = Path(self.gen_filename(dtype, date) + ".csv")
+        ensure_dir(dpath)
+        savepath = dpath / filename
+        with open(savepath, 'wt', newline = '', encoding = 'utf-8') as csv_file:
+            csv_write = csv.writer(csv_file)
+            csv_write.writerow(header)
+            csv_write.writerows(table)
 
     def parse_table_to_list(self, html: str, table_name: str, ignore_lines: int = 2, table_number:int = 0) -> typing.List[typing.List[str]]:
         """Extract 2dim table from HTML text
@@ -112,10 +351,8 @@ class AMeDASNode(AmedasNode):
         return table_data
 
 class AMeDAS(Amedas):
-    def load(self, d: dict):
-        for key, value in d.items():
-            self.amedas_nodes[key] = AMeDASNode.load(value)
-    
+    node_class = AMeDASNode
+
     def prepare_fuzzyfinder(self):
         sug_list = []
         name2id = {}
@@ -0,0 +1,405 @@
+from amedasdl_core import AmedasDataType, AmedasError
+import argparse
+import csv
+import datetime
+import math
+import sys
+import typing
+from pathlib import Path
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+# quality flag order, larger is worse
+FLAG_NORMAL = 0
+FLAG_QUASI = 1          # ")" 準正常値
+FLAG_INSUFFICIENT = 2   # "]" 資料不足値
+FLAG_DOUBT = 3          # "#" 疑問値
+FLAG_MISSING = 4        # "///" 欠測, "×" 障害
+FLAG_SUFFIX = ["", ")", "]", "#", "///"]
+
+DIRECTIONS = ["北", "北北東", "北東", "東北東", "東", "東南東", "南東", "南南東",
+              "南", "南南西", "南西", "西南西", "西", "西北西", "北西", "北北西"]
+DIRECTION_DEG = {d: i * 22.5 for i, d in enumerate(DIRECTIONS)}
+
+PERIODS = ("day", "tendays", "month", "year")
+
+EXPECTED_ROWS = {
+    AmedasDataType.TENMINUTES: 144,
+    AmedasDataType.HOUR: 24,
+}
+
+
+def parse_value(cell: str) -> typing.Tuple[typing.Optional[float], int]:
+    """Parse one observation cell
+
+    Parameters
+    ----------
+    cell : str
+        raw cell text
+
+    Returns
+    -------
+    typing.Tuple[typing.Optional[float], int]
+        value (None if missing) and quality flag
+    """
+    c = cell.strip()
+    if c == "" or "///" in c or "×" in c:
+        return None, FLAG_MISSING
+    if c == "--":
+        # no phenomenon
+        return 0.0, FLAG_NORMAL
+    flag = FLAG_NORMAL
+    if c.endswith(")"):
+        flag = FLAG_QUASI
+    elif c.endswith("]"):
+        flag = FLAG_INSUFFICIENT
+    elif "#" in c:
+        flag = FLAG_DOUBT
+    c = c.rstrip(")]#").replace("#", "").strip()
+    try:
+        return float(c), flag
+    except ValueError:
+        return None, FLAG_MISSING
+
+
+def parse_direction(cell: str) -> typing.Tuple[typing.Optional[float], int]:
+    """Parse 16 direction cell to degree, calm is None with normal flag
+    """
+    c = cell.strip()
+    flag = FLAG_NORMAL
+    if c.endswith(")"):
+        flag = FLAG_QUASI
+    elif c.endswith("]"):
+        flag = FLAG_INSUFFICIENT
+    c = c.rstrip(")]#").strip()
+    if c in DIRECTION_DEG:
+        return DIRECTION_DEG[c], flag
+    if c == "静穏":
+        return None, flag
+    return None, FLAG_MISSING
+
+
+def direction_name(deg: typing.Optional[float]) -> str:
+    if deg is None:
+        return "静穏"
+    return DIRECTIONS[int(((deg % 360) + 11.25) // 22.5) % 16]
+
+
+def column_kind(name: str) -> str:
+    """Aggregation kind from csv header name
+
+    Parameters
+    ----------
+    name : str
+        header name
+
+    Returns
+    -------
+    str
+        "sum", "stat", "wind", "gust", "dir" or "skip"
+    """
+    if name in ("時", "時分") or "天気" in name:
+        return "skip"
+    if "風向" in name:
+        return "dir"
+    if "最大瞬間風速" in name:
+        return "gust"
+    if "風速" in name:
+        return "wind"
+    if "降水量" in name or "日照時間" in name or "降雪" in name or "日射量" in name:
+        return "sum"
+    return "stat"
+
+
+def period_key(period: str, date: datetime.date):
+    """Period key of date
+
+    Parameters
+    ----------
+    period : str
+        "day", "tendays", "month" or "year"
+    date : datetime.date
+        date
+
+    Returns
+    -------
+    typing.Hashable
+        sortable key
+    """
+    if period == "day":
+        return date
+    if period == "tendays":
+        return (date.year, date.month, min((date.day - 1) // 10, 2))
+    if period == "month":
+        return (date.year, date.month)
+    if period == "year":
+        return date.year
+    raise AmedasError(f"Not Support Period {period}")
+
+
+def period_label(period: str, key) -> str:
+    if period == "day":
+        return key.strftime("%Y-%m-%d")
+    if period == "tendays":
+        return f"{key[0]:04d}-{key[1]:02d} {['上旬', '中旬', '下旬'][key[2]]}"
+    if period == "month":
+        return f"{key[0]:04d}-{key[1]:02d}"
+    return f"{key:04d}"
+
+
+class _Acc():
+    """Mergeable column accumulator
+    """
+    __slots__ = ("total", "count", "expected", "vmin", "vmax", "u", "v", "vdir", "vdflag", "flag", "dcount", "dflag")
+
+    def __init__(self) -> None:
+        self.total = 0.0
+        self.count = 0
+        self.expected = 0
+        self.vmin = math.inf
+        self.vmax = -math.inf
+        self.u = 0.0
+        self.v = 0.0
+        self.vdir: typing.Optional[float] = None
+        self.vdflag = FLAG_NORMAL
+        self.flag = FLAG_NORMAL
+        # samples with known direction (calm included), kept apart from speed
+        self.dcount = 0
+        self.dflag = FLAG_NORMAL
+
+    def add(self, value: typing.Optional[float], flag: int, deg: typing.Optional[float] = None, dflag: int = FLAG_NORMAL) -> None:
+        self.expected += 1
+        if value is None:
+            return
+        self.flag = max(self.flag, flag)
+        self.total += value
+        self.count += 1
+        self.vmin = min(self.vmin, value)
+        if value > self.vmax:
+            self.vmax = value
+            self.vdir = deg
+            self.vdflag = dflag
+        if dflag == FLAG_MISSING:
+            # speed is still valid, only left out of the vector sum
+            return
+        self.dcount += 1
+        self.dflag = max(self.dflag, dflag)
+        if deg is not None:
+            # direction is where wind comes from
+            self.u += value * math.sin(math.radians(deg))
+            self.v += value * math.cos(math.radians(deg))
+
+    def merge(self, other: "_Acc") -> None:
+        self.total += other.total
+        self.count += other.count
+        self.expected += other.expected
+        self.vmin = min(self.vmin, other.vmin)
+        if other.vmax > self.vmax:
+            self.vmax = other.vmax
+            self.vdir = other.vdir
+            self.vdflag = other.vdflag
+        self.u += other.u
+        self.v += other.v
+        self.flag = max(self.flag, other.flag)
+        self.dcount += other.dcount
+        self.dflag = max(self.dflag, other.dflag)
+
+    def quality(self) -> int:
+        if self.count == 0:
+            return FLAG_MISSING
+        missing = 1 - self.count / self.expected
+        if missing > 0.2:
+            return max(self.flag, FLAG_INSUFFICIENT)
+        if missing > 0:
+            return max(self.flag, FLAG_QUASI)
+        return self.flag
+
+    def dir_quality(self) -> int:
+        """Quality of mean direction, speed samples without direction downgrade it
+        """
+        if self.dcount == 0:
+            return FLAG_MISSING
+        q = max(self.quality(), self.dflag)
+        missing = 1 - self.dcount / self.count
+        if missing > 0.2:
+            return max(q, FLAG_INSUFFICIENT)
+        if missing > 0:
+            return max(q, FLAG_QUASI)
+        return q
+
+
+def _fmt(value: typing.Optional[float], flag: int) -> str:
+    if flag == FLAG_MISSING or value is None:
+        return FLAG_SUFFIX[FLAG_MISSING]
+    return f"{round(value, 1)}{FLAG_SUFFIX[flag]}"
+
+
+class Aggregator():
+    """Daily, 10-day, monthly and annual rollup from TENMINUTES/HOUR tables
+
+    Per-day accumulators are kept, so adding or replacing a day only
+    recomputes the periods which contain that day.
+    """
+    def __init__(self, dtype: AmedasDataType, header: typing.List[str]) -> None:
+        """
+        Parameters
+        ----------
+        dtype : AmedasDataType
+            TENMINUTES or HOUR
+        header : typing.List[str]
+            csv header of the table
+        """
+        if dtype not in EXPECTED_ROWS:
+            raise AmedasError(f"Not Support {dtype.name} for aggregation")
+        self.dtype = dtype
+        self.header = header
+        self.kinds = [column_kind(h) for h in header]
+        # direction column paired to the speed column just before it
+        self.dir_of: typing.Dict[int, int] = {}
+        for i, k in enumerate(self.kinds):
+            if k in ("wind", "gust") and i + 1 < len(self.kinds) and self.kinds[i + 1] == "dir":
+                self.dir_of[i] = i + 1
+        self.columns = [i for i, k in enumerate(self.kinds) if k not in ("skip", "dir")]
+        self.days: typing.Dict[datetime.date, typing.List[_Acc]] = {}
+        self.__members: typing.Dict[str, typing.Dict[typing.Any, typing.Set[datetime.date]]] = {p: {} for p in PERIODS}
+        self.__cache: typing.Dict[str, typing.Dict[typing.Any, typing.List[str]]] = {p: {} for p in PERIODS}
+
+    def add_day(self, date: datetime.date, table: typing.List[typing.List[str]]) -> None:
+        """Add or replace one day table
+
+        Parameters
+        ----------
+        date : datetime.date
+            page date
+        table : typing.List[typing.List[str]]
+            parsed table (without header)
+        """
+        accs = [_Acc() for _ in self.columns]
+        for row in table:
+            if len(row) < len(self.header):
+                continue
+            for acc, i in zip(accs, self.columns):
+                value, flag = parse_value(row[i])
+                deg, dflag = None, FLAG_NORMAL
+                if i in self.dir_of:
+                    deg, dflag = parse_direction(row[self.dir_of[i]])
+                acc.add(value, flag, deg, dflag)
+        # rows not in page are missing
+        expected = EXPECTED_ROWS[self.dtype]
+        for acc in accs:
+            acc.expected = max(acc.expected, expected)
+        self.days[date] = accs
+        for p in PERIODS:
+            key = period_key(p, date)
+            self.__members[p].setdefault(key, set()).add(date)
+            self.__cache[p].pop(key, None)
+
+    def header_for(self, period: str) -> typing.List[str]:
+        names = [{"day": "日付", "tendays": "旬", "month": "年月", "year": "年"}[period]]
+        for i in self.columns:
+            name = self.header[i]
+            kind = self.kinds[i]
+            if kind == "sum":
+                names.append(f"{name} 合計")
+            elif kind == "wind":
+                names += [f"{name} 平均", f"{self.header[self.dir_of[i]]} 平均" if i in self.dir_of else f"{name} 風向"]
+            elif kind == "gust":
+                names += [f"{name} 最大", f"{self.header[self.dir_of[i]]}" if i in self.dir_of else f"{name} 風向"]
+            else:
+                names += [f"{name} 平均", f"{name} 最高", f"{name} 最低"]
+        return names
+
+    def __compute(self, period: str, key) -> typing.List[str]:
+        merged = [_Acc() for _ in self.columns]
+        for date in self.__members[period][key]:
+            for m, a in zip(merged, self.days[date]):
+                m.merge(a)
+        row = [period_label(period, key)]
+        for acc, i in zip(merged, self.columns):
+            kind = self.kinds[i]
+            q = acc.quality()
+            if kind == "sum":
+                row.append(_fmt(acc.total, q))
+            elif kind == "wind":
+                row.append(_fmt(acc.total / acc.count if acc.count else None, q))
+                dq = acc.dir_quality()
+                if dq == FLAG_MISSING:
+                    row.append(FLAG_SUFFIX[dq])
+                elif acc.u == 0 and acc.v == 0:
+                    row.append("静穏")
+                else:
+                    row.append(direction_name(math.degrees(math.atan2(acc.u, acc.v))) + FLAG_SUFFIX[dq])
+            elif kind == "gust":
+                row.append(_fmt(acc.vmax, q))
+                dq = max(q, acc.vdflag)
+                row.append(FLAG_SUFFIX[dq] if dq == FLAG_MISSING else direction_name(acc.vdir) + FLAG_SUFFIX[dq])
+            else:
+                row.append(_fmt(acc.total / acc.count if acc.count else None, q))
+                row.append(_fmt(acc.vmax, q))
+                row.append(_fmt(acc.vmin, q))
+        return row
+
+    def rollup(self, period: str) -> typing.List[typing.List[str]]:
+        """Rollup table, only changed periods are recomputed
+
+        Parameters
+        ----------
+        period : str
+            "day", "tendays", "month" or "year"
+
+        Returns
+        -------
+        typing.List[typing.List[str]]
+            rows sorted by period (without header)
+        """
+        cache = self.__cache[period]
+        for key in self.__members[period]:
+            if key not in cache:
+                cache[key] = self.__compute(period, key)
+        return [cache[k] for k in sorted(cache)]
+
+
+def parse_csv_filename(path: Path) -> typing.Tuple[datetime.date, str, AmedasDataType]:
+    """Parse saved csv file name "YYYYMMDD_blockno_DTYPE.csv"
+    """
+    date, block_no, dtype = path.stem.split("_", 2)
+    return datetime.datetime.strptime(date, "%Y%m%d").date(), block_no, AmedasDataType[dtype]
+
+
+def aggregate_files(paths: typing.Iterable[Path], period: str) -> typing.List[typing.List[str]]:
+    """Rollup saved per-day csv files of one station and dtype
+
+    Parameters
+    ----------
+    paths : typing.Iterable[Path]
+        csv files saved by save_csv
+    period : str
+        "day", "tendays", "month" or "year"
+
+    Returns
+    -------
+    typing.List[typing.List[str]]
+        header and rows
+    """
+    agg = None
+    for p in sorted(paths):
+        date, _, dtype = parse_csv_filename(p)
+        with open(p, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        if len(rows) == 0:
+            continue
+        if agg is None:
+            agg = Aggregator(dtype, rows[0])
+        agg.add_day(date, rows[1:])
+    if agg is None:
+        return []
+    return [agg.header_for(period)] + agg.rollup(period)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="保存済みの10分値・時間値csvから日・旬・月・年の統計値を計算する")
+    parser.add_argument("-p", "--period", type=str, default="day", help="集計期間 [day, tendays, month, year]")
+    parser.add_argument("files", nargs="+", type=Path, help="1地点1種類のcsvファイル")
+    opt = parser.parse_args()
+    csv.writer(sys.stdout).writerows(aggregate_files(opt.files, opt.period))
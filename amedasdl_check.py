@@ -0,0 +1,269 @@
+from amedasdl_core import AmedasDataType
+from amedasdl_agg import EXPECTED_ROWS
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import os
+import sys
+import typing
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+STEPS = {
+    AmedasDataType.TENMINUTES: datetime.timedelta(minutes=10),
+    AmedasDataType.HOUR: datetime.timedelta(hours=1),
+}
+
+
+class DayState(typing.NamedTuple):
+    """Check result of one station-day
+    """
+    date: datetime.date
+    rows: int
+    all_missing: bool
+
+
+def is_missing_cell(cell: str) -> bool:
+    c = cell.strip()
+    return c == "" or "///" in c or "×" in c
+
+
+def _open(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def classify(path: Path) -> typing.Optional[typing.Tuple[str, AmedasDataType, str]]:
+    """Classify saved file name
+
+    Parameters
+    ----------
+    path : Path
+        file path
+
+    Returns
+    -------
+    typing.Optional[typing.Tuple[str, AmedasDataType, str]]
+        ("day" or "bulk", dtype, output format), None if not a csv of supported dtype
+    """
+    name = path.name
+    if name.endswith(".csv.gz"):
+        stem = name[:-len(".csv.gz")]
+    elif name.endswith(".csv"):
+        stem = name[:-len(".csv")]
+    else:
+        return None
+    parts = stem.split("_")
+    if len(parts) == 3 and parts[0].isdigit() and len(parts[0]) == 8:
+        kind, dtype_name = "day", parts[2]
+    elif len(parts) >= 3:
+        kind, dtype_name = "bulk", parts[1]
+    else:
+        return None
+    try:
+        dtype = AmedasDataType[dtype_name]
+    except KeyError:
+        return None
+    if dtype not in EXPECTED_ROWS:
+        return None
+    return kind, dtype, "csv" if kind == "day" else "csvbulk"
+
+
+def scan_file(path: Path) -> typing.List[DayState]:
+    """Count rows per day of one saved csv
+
+    Parameters
+    ----------
+    path : Path
+        per-day csv or consolidated csv
+
+    Returns
+    -------
+    typing.List[DayState]
+        state per day found in file
+    """
+    c = classify(path)
+    if c is None:
+        return []
+    kind, dtype, _ = c
+    with _open(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        if kind == "day":
+            date = datetime.datetime.strptime(path.name[:8], "%Y%m%d").date()
+            rows = 0
+            all_missing = True
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                rows += 1
+                if all_missing and not all(is_missing_cell(cell) for cell in row[1:]):
+                    all_missing = False
+            return [DayState(date, rows, all_missing)]
+        # consolidated, first column is timestamp, second is page time column
+        step = STEPS[dtype]
+        days: typing.Dict[datetime.date, typing.List] = {}
+        for row in reader:
+            if len(row) < 2:
+                continue
+            date = (datetime.datetime.strptime(row[0], "%Y-%m-%d %H:%M") - step).date()
+            d = days.setdefault(date, [0, True])
+            d[0] += 1
+            if d[1] and not all(is_missing_cell(cell) for cell in row[2:]):
+                d[1] = False
+        return [DayState(date, rows, all_missing) for date, (rows, all_missing) in days.items()]
+
+
+def _scan_many(paths: typing.List[Path]) -> typing.List[typing.Tuple[Path, typing.List[DayState]]]:
+    return [(p, scan_file(p)) for p in paths]
+
+
+def scan_tree(root: Path, workers: typing.Optional[int] = None) -> typing.Dict[typing.Tuple[str, AmedasDataType, str], typing.Dict[datetime.date, DayState]]:
+    """Scan output tree on many processes
+
+    Parameters
+    ----------
+    root : Path
+        output root (./data)
+    workers : typing.Optional[int], optional
+        number of processes, by default cpu count
+
+    Returns
+    -------
+    typing.Dict[typing.Tuple[str, AmedasDataType, str], typing.Dict[datetime.date, DayState]]
+        (station dir name, dtype, output format) to state per day
+    """
+    paths = [p for p in root.rglob("*.csv*") if classify(p) is not None]
+    workers = workers or os.cpu_count() or 1
+    # coarse chunks, per-file task overhead is larger than the scan itself
+    size = max(1, min(256, len(paths) // (workers * 4) or 1))
+    chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
+    result: typing.Dict[typing.Tuple[str, AmedasDataType, str], typing.Dict[datetime.date, DayState]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for scanned in executor.map(_scan_many, chunks):
+            for path, states in scanned:
+                _, dtype, output = classify(path)
+                station = path.relative_to(root).parts[0]
+                days = result.setdefault((station, dtype, output), {})
+                for s in states:
+                    old = days.get(s.date)
+                    if old is None or s.rows > old.rows:
+                        days[s.date] = s
+    return result
+
+
+def find_broken(days: typing.Dict[datetime.date, DayState], dtype: AmedasDataType, start: typing.Optional[datetime.date] = None, end: typing.Optional[datetime.date] = None) -> typing.Dict[datetime.date, str]:
+    """Broken dates of one station and dtype
+
+    Parameters
+    ----------
+    days : typing.Dict[datetime.date, DayState]
+        scanned days
+    dtype : AmedasDataType
+        Data Type
+    start : typing.Optional[datetime.date], optional
+        first date, by default first found date
+    end : typing.Optional[datetime.date], optional
+        end date (exclusive), by default day after last found date
+
+    Returns
+    -------
+    typing.Dict[datetime.date, str]
+        date to reason
+    """
+    if not days and (start is None or end is None):
+        return {}
+    start = start or min(days)
+    end = end or max(days) + datetime.timedelta(days=1)
+    expected = EXPECTED_ROWS[dtype]
+    broken = {}
+    for i in range((end - start).days):
+        date = start + datetime.timedelta(days=i)
+        s = days.get(date)
+        if s is None:
+            broken[date] = "missing"
+        elif s.rows < expected:
+            broken[date] = f"short {s.rows}/{expected}"
+        elif s.all_missing:
+            broken[date] = "all ///"
+    return broken
+
+
+def refetch_spec(broken: typing.Dict[typing.Tuple[str, AmedasDataType, str], typing.Dict[datetime.date, str]], oids: typing.Dict[str, str]) -> dict:
+    """Build job spec (amedasdl_job) to refetch broken days
+
+    Parameters
+    ----------
+    broken : typing.Dict[typing.Tuple[str, AmedasDataType, str], typing.Dict[datetime.date, str]]
+        broken dates per (station dir name, dtype, output format)
+    oids : typing.Dict[str, str]
+        station dir name to registry key
+
+    Returns
+    -------
+    dict
+        job spec
+    """
+    jobs = []
+    for (station, dtype, output), dates in sorted(broken.items(), key=lambda x: (x[0][0], x[0][1].name, x[0][2])):
+        if not dates or station not in oids:
+            continue
+        jobs.append({
+            "oid": [oids[station]],
+            "dtype": [dtype.name],
+            "dates": [d.strftime("%Y%m%d") for d in sorted(dates)],
+            "output": [output],
+        })
+    return {"jobs": jobs}
+
+
+def station_oids(stations: typing.Iterable[str]) -> typing.Dict[str, str]:
+    """Resolve output dir names "blockno_group_name" to registry key
+    """
+    from amedasdl_adv import AMeDAS
+    ams = AMeDAS()
+    dirnames = {f"{a.block_no}_{a.group_name}_{a.name}": f"{a.prec_no}{a.block_no}" for a in ams.list()}
+    oids = {}
+    for st in stations:
+        if st in dirnames:
+            oids[st] = dirnames[st]
+        else:
+            print(f"[WARNING] Not Found Location for {st}", file=sys.stderr)
+    return oids
+
+
+def getOption():
+    parser = argparse.ArgumentParser(description="保存済みcsvの欠損を検査し，再取得用のジョブ定義を出力する")
+    parser.add_argument("root", nargs="?", type=Path, default=Path("./data"), help="出力ディレクトリ")
+    parser.add_argument("-s", "--start", type=str, default=None, help="開始日時  YYYYMMDD形式")
+    parser.add_argument("-e", "--end", type=str, default=None, help="終了日時  YYYYMMDD形式（含まない）")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="並列プロセス数")
+    parser.add_argument("-o", "--output", type=str, default=None, help="再取得用ジョブ定義の出力先 省略時は標準出力")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = getOption()
+    start = datetime.datetime.strptime(opt.start, "%Y%m%d").date() if opt.start else None
+    end = datetime.datetime.strptime(opt.end, "%Y%m%d").date() if opt.end else None
+    scanned = scan_tree(opt.root, opt.jobs)
+    broken = {}
+    for key, days in scanned.items():
+        b = find_broken(days, key[1], start, end)
+        for date, reason in sorted(b.items()):
+            print(f"{key[0]} {key[1].name} {date.strftime('%Y%m%d')} : {reason}", file=sys.stderr)
+        if b:
+            broken[key] = b
+    spec = refetch_spec(broken, station_oids(set(k[0] for k in broken)))
+    if opt.output:
+        with open(opt.output, "w", encoding="utf-8") as f:
+            json.dump(spec, f, indent=4, ensure_ascii=False)
+    else:
+        json.dump(spec, sys.stdout, indent=4, ensure_ascii=False)
+    sys.exit(1 if broken else 0)
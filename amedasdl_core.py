@@ -1,8 +1,11 @@
 import json
+import math
+import os
 from enum import Enum
 import datetime
 import requests
 import time
+import threading
 import typing
 from pathlib import Path
 
@@ -11,7 +14,280 @@ __version__ = '1.0.0'
 
 class AmedasError(BaseException): pass
 
-AMEDAS_BASEURL = "https://www.data.jma.go.jp/obd/stats/etrn/view/"
+class AmedasHTTPError(AmedasError):
+    def __init__(self, status: int, url: str) -> None:
+        super().__init__(f"HTTP {status} : {url}")
+        self.status = status
+
+JST = datetime.timezone(datetime.timedelta(hours=9), "JST")
+
+AMEDAS_BASEURL = os.environ.get("AMEDAS_BASEURL", "https://www.data.jma.go.jp/obd/stats/etrn/view/")
+# seconds to connect and between received bytes, a stalled request counts as an error (status 0)
+AMEDAS_TIMEOUT = float(os.environ.get("AMEDAS_TIMEOUT", "30"))
+
+_created_dirs: typing.Set[Path] = set()
+
+
+def jst_today() -> datetime.date:
+    """Today in Japan Standard Time regardless of host time zone
+
+    Returns
+    -------
+    datetime.date
+        today (JST)
+    """
+    return datetime.datetime.now(JST).date()
+
+_local = threading.local()
+
+
+class RateLimiter():
+    """Request Rate Limiter shared by all threads
+    """
+    def __init__(self, interval: float = 1.0) -> None:
+        """
+        Parameters
+        ----------
+        interval : float, optional
+            minimum seconds between requests, by default 1.0
+        """
+        self.interval = interval
+        self.__lock = threading.Lock()
+        self.__next = 0.0
+
+    def wait(self) -> None:
+        """block until next request slot
+        """
+        with self.__lock:
+            now = time.monotonic()
+            slot = max(now, self.__next)
+            self.__next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def observe(self, latency: float, status: int) -> None:
+        """result of request started by wait()
+
+        Parameters
+        ----------
+        latency : float
+            seconds
+        status : int
+            HTTP status, 0 is connection error
+        """
+        pass
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """AIMD Rate Limiter
+
+    Rate and concurrency increase step by step while p95 latency and
+    error rate stay in bounds, and halve on slowdown or 429/503.
+    """
+    def __init__(self, max_rate: float = 5.0, max_concurrency: int = 4, min_rate: float = 0.2, start_rate: float = 1.0, target_p95: float = 2.0, max_error_rate: float = 0.05, window: int = 20, step: float = 0.25) -> None:
+        """
+        Parameters
+        ----------
+        max_rate : float, optional
+            ceiling of request per second, by default 5.0
+        max_concurrency : int, optional
+            ceiling of requests in flight, by default 4
+        min_rate : float, optional
+            floor of request per second, by default 0.2
+        start_rate : float, optional
+            initial request per second, by default 1.0
+        target_p95 : float, optional
+            p95 latency bound seconds, by default 2.0
+        max_error_rate : float, optional
+            error rate bound, by default 0.05
+        window : int, optional
+            requests per adjustment, by default 20
+        step : float, optional
+            additive increase of request per second, by default 0.25
+        """
+        self.rate = min(max(start_rate, min_rate), max_rate)
+        super().__init__(1.0 / self.rate)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = 1
+        self.target_p95 = target_p95
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.step = step
+        self.__cond = threading.Condition()
+        self.__in_flight = 0
+        self.__latencies: typing.List[float] = []
+        self.__errors = 0
+        self.__increasing = True
+        self.__last_backoff = -math.inf
+
+    def wait(self) -> None:
+        with self.__cond:
+            while self.__in_flight >= self.concurrency:
+                self.__cond.wait()
+            self.__in_flight += 1
+        super().wait()
+
+    def __set(self, rate: float, concurrency: int, reason: str) -> None:
+        increasing = rate > self.rate
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.interval = 1.0 / self.rate
+        self.concurrency = min(max(concurrency, 1), self.max_concurrency)
+        if increasing != self.__increasing:
+            # turning point, the rate around here is sustainable
+            print(f"[Info] Rate {self.rate:.2f} req/s, concurrency {self.concurrency} ({reason})")
+        self.__increasing = increasing
+        self.__latencies.clear()
+        self.__errors = 0
+
+    def observe(self, latency: float, status: int) -> None:
+        with self.__cond:
+            self.__in_flight -= 1
+            self.__cond.notify()
+            concurrency = self.concurrency
+            if status in (429, 503):
+                # back off at once, and again once per round trip while they continue,
+                # requests sent before the last backoff may still be throttled
+                now = time.monotonic()
+                if now - latency >= self.__last_backoff:
+                    self.__set(self.rate / 2, self.concurrency // 2, f"HTTP {status}")
+                    self.__last_backoff = now
+            self.__latencies.append(latency)
+            if status == 0 or status >= 400:
+                self.__errors += 1
+            if len(self.__latencies) < self.window:
+                return
+            lat = sorted(self.__latencies)
+            p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+            error_rate = self.__errors / len(lat)
+            if p95 > self.target_p95 or error_rate > self.max_error_rate:
+                self.__set(self.rate / 2, self.concurrency // 2, f"p95 {p95:.2f}s, error {error_rate:.1%}")
+            else:
+                self.__set(self.rate + self.step, self.concurrency + 1, f"p95 {p95:.2f}s, error {error_rate:.1%}")
+            if self.concurrency > concurrency:
+                # more than one waiting thread may start now
+                self.__cond.notify_all()
+
+
+rate_limiter = RateLimiter(1.0)
+max_retries = 2
+
+
+def get_session() -> requests.Session:
+    """keep-alive session per thread
+
+    Returns
+    -------
+    requests.Session
+        session
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+
+class HttpTransport():
+    """Fetch page by HTTP
+
+    Parameters
+    ----------
+    timeout : typing.Optional[float], optional
+        seconds, by default AMEDAS_TIMEOUT
+    """
+    def __init__(self, timeout: typing.Optional[float] = None) -> None:
+        self.timeout = AMEDAS_TIMEOUT if timeout is None else timeout
+
+    def get(self, url: str) -> str:
+        """GET url
+
+        Parameters
+        ----------
+        url : str
+            url
+
+        Returns
+        -------
+        str
+            html text
+
+        Raises
+        ------
+        AmedasError
+            HTTP error status or timeout
+        """
+        try:
+            response = get_session().get(url, timeout=self.timeout)
+        except requests.Timeout as e:
+            raise AmedasError(f"Timeout {self.timeout}s {url} : {e}")
+        if response.status_code >= 400:
+            raise AmedasHTTPError(response.status_code, url)
+        response.encoding = "utf-8"
+        return response.text
+
+
+transport = HttpTransport()
+
+
+def fetch(url: str) -> str:
+    """GET url by transport under rate_limiter, retry 429/503
+
+    Parameters
+    ----------
+    url : str
+        url
+
+    Returns
+    -------
+    str
+        html text
+
+    Raises
+    ------
+    AmedasError
+        Any Error
+    """
+    for retry in range(max_retries + 1):
+        limiter = rate_limiter
+        limiter.wait() # Force Requset Rate Limit
+        begin = time.monotonic()
+        status = 0
+        try:
+            html = transport.get(url)
+            status = 200
+            return html
+        except AmedasHTTPError as e:
+            status = e.status
+            # server is busy, retry after limiter backoff
+            if status not in (429, 503) or retry == max_retries:
+                raise
+        except AmedasError:
+            raise
+        except Exception as e:
+            raise AmedasError(e)
+        finally:
+            limiter.observe(time.monotonic() - begin, status)
+
+
+def ensure_dir(dpath: Path) -> Path:
+    """mkdir once per process
+
+    Parameters
+    ----------
+    dpath : pathlib.Path
+        directory path
+
+    Returns
+    -------
+    pathlib.Path
+        same as dpath
+    """
+    if dpath not in _created_dirs:
+        dpath.mkdir(parents=True, exist_ok=True)
+        _created_dirs.add(dpath)
+    return dpath
 
 class AmedasDataType(str, Enum):
     """AMeDAS Site Support Data Type
@@ -173,11 +449,11 @@ class AmedasNode():
         Returns
         -------
         bool
-            if between one day True
+            if before today (JST) True
         """
-        thdt = datetime.datetime.now() - datetime.timedelta(days=1)
-        thdt = thdt.replace(hour=23, minute=59, second=59, microsecond=0)
-        return date < thdt
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        return date < jst_today()
     
     def __internal_download(self, url: str) -> str:
         """internal download
@@ -197,14 +473,7 @@ class AmedasNode():
         AMeDASError
             Any Error
         """
-        try:
-            time.sleep(1) # Force Requset Rate Limit
-            response = requests.get(url)
-            response.encoding = "utf-8"
-            html = response.text
-        except Exception as e:
-            raise AmedasError(e)
-        return html
+        return fetch(url)
     
     def download(self, dtype: AmedasDataType, date: datetime.date) -> str:
         """download data
@@ -226,6 +495,16 @@ class AmedasNode():
         html = self.__internal_download(url)
         return html
     
+    def gen_rootpath(self) -> Path:
+        """generate save root dir name
+
+        Returns
+        -------
+        pathlib.Path
+            dirpath
+        """
+        return Path(f"./data/{self.block_no}_{self.group_name}_{self.name}")
+
     def gen_savepath(self, date: datetime.date) -> Path:
         """generate save dir name
 
@@ -239,7 +518,7 @@ class AmedasNode():
         pathlib.Path
             dirpath
         """
-        droot = Path(f"./data/{self.block_no}_{self.group_name}_{self.name}")
+        droot = self.gen_rootpath()
         year_dir = Path(date.strftime("%Y"))
         month_dir = Path(date.strftime("%m"))
         day_dir = Path(date.strftime("%d"))
@@ -272,43 +551,258 @@ class AmedasNode():
         date : datetime.date
             date
         """
+        html = self.download(dtype, date)
+        self.write_html(dtype, date, html)
+
+    def write_html(self, dtype: AmedasDataType, date: datetime.date, html: str) -> None:
+        """write downloaded HTML to file
+
+        Parameters
+        ----------
+        dtype : AmedasDataType
+            Data Type
+        date : datetime.date
+            date
+        html : str
+            HTML text
+        """
         dpath = self.gen_savepath(date)
         filename = Path(self.gen_filename(dtype, date) + ".html")
-        dpath.mkdir(parents=True, exist_ok=True)
+        ensure_dir(dpath)
         savepath = dpath / filename
-        html = self.download(dtype, date)
         with open(savepath, "w") as f:
             f.write(html)
 
 
+REGISTRY_DIR = Path(__file__).resolve().parent / "amedas_registry"
+
+
+def _node_latlon(value: dict) -> typing.Optional[typing.Tuple[float, float]]:
+    try:
+        return float(value["lat_d"]) + float(value["lat_m"]) / 60, float(value["lon_d"]) + float(value["lon_m"]) / 60
+    except (KeyError, ValueError):
+        return None
+
+
+def _extent(values: typing.Iterable[dict]) -> typing.Optional[typing.List[float]]:
+    """[min lat, max lat, min lon, max lon] of stations
+    """
+    points = [p for p in (_node_latlon(v) for v in values) if p is not None]
+    if not points:
+        return None
+    return [min(p[0] for p in points), max(p[0] for p in points), min(p[1] for p in points), max(p[1] for p in points)]
+
+
+def write_registry(d: dict, root: Path = REGISTRY_DIR) -> None:
+    """Write station list as per prec_no shards and a small index
+
+    Parameters
+    ----------
+    d : dict
+        station list same as amedas.json
+    root : Path, optional
+        output dir, by default REGISTRY_DIR
+    """
+    shards: typing.Dict[str, typing.Dict[str, dict]] = {}
+    index: typing.Dict[str, dict] = {"prec_no": {}, "oid": {}, "block_no": {}, "name": {}}
+    for key, value in d.items():
+        prec_no = value["prec_no"]
+        shards.setdefault(prec_no, {})[key] = value
+        index["oid"][key] = prec_no
+        index["block_no"].setdefault(value["block_no"], []).append(key)
+        index["name"].setdefault(value["name"], []).append(key)
+    for prec_no, shard in shards.items():
+        # extent of shard for search_near
+        index["prec_no"][prec_no] = _extent(shard.values())
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    for prec_no, shard in shards.items():
+        with open(root / f"{prec_no}.json", "w", encoding="utf-8") as f:
+            json.dump(shard, f, ensure_ascii=False)
+    with open(root / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+
+
+class _Registry():
+    """Station registry sharded by prec_no
+
+    Only the index (oid, block_no and name to prec_no, extent of shards)
+    is read up front. Station data of a shard is read from {prec_no}.json
+    and its nodes are created when a lookup needs the shard.
+    """
+    def __init__(self, root: typing.Optional[Path] = None) -> None:
+        """
+        Parameters
+        ----------
+        root : typing.Optional[Path], optional
+            dir written by write_registry, by default None (empty registry)
+        """
+        self.root = root
+        self.shards: typing.Dict[str, typing.Dict[str, dict]] = {}
+        self.extent: typing.Dict[str, typing.Optional[typing.List[float]]] = {}
+        self.oid2prec: typing.Dict[str, str] = {}
+        self.block2oid: typing.Dict[str, typing.List[str]] = {}
+        self.name2oid: typing.Dict[str, typing.List[str]] = {}
+        self.nodes: typing.Dict[typing.Tuple[type, str], typing.Dict[str, AmedasNode]] = {}
+        self.lock = threading.RLock()
+        if root is not None:
+            with open(root / "index.json", encoding="utf-8") as f:
+                index = json.load(f)
+            self.extent = index["prec_no"]
+            self.oid2prec = index["oid"]
+            self.block2oid = index["block_no"]
+            self.name2oid = index["name"]
+
+    def raw(self, prec_no: str) -> typing.Dict[str, dict]:
+        """Station data of shard, read on first use
+        """
+        shard = self.shards.get(prec_no)
+        if shard is not None:
+            return shard
+        with self.lock:
+            shard = self.shards.get(prec_no)
+            if shard is None:
+                shard = {}
+                if self.root is not None and prec_no in self.extent:
+                    with open(self.root / f"{prec_no}.json", encoding="utf-8") as f:
+                        shard = json.load(f)
+                self.shards[prec_no] = shard
+        return shard
+
+    def update(self, d: dict) -> None:
+        with self.lock:
+            touched = set()
+            for key, value in d.items():
+                prec_no = value["prec_no"]
+                shard = self.raw(prec_no)
+                if key not in shard:
+                    self.block2oid.setdefault(value["block_no"], []).append(key)
+                    self.name2oid.setdefault(value["name"], []).append(key)
+                shard[key] = value
+                self.oid2prec[key] = prec_no
+                touched.add(prec_no)
+            for prec_no in touched:
+                self.extent[prec_no] = _extent(self.shards[prec_no].values())
+            # rebuild changed shards on next lookup
+            self.nodes = {k: v for k, v in self.nodes.items() if k[1] not in touched}
+
+    def shard(self, node_class: type, prec_no: str) -> typing.Dict[str, AmedasNode]:
+        nodes = self.nodes.get((node_class, prec_no))
+        if nodes is not None:
+            return nodes
+        raw = self.raw(prec_no)
+        with self.lock:
+            nodes = self.nodes.get((node_class, prec_no))
+            if nodes is None:
+                nodes = {key: node_class.load(value) for key, value in raw.items()}
+                self.nodes[(node_class, prec_no)] = nodes
+        return nodes
+
+
+_registry: typing.Optional[_Registry] = None
+
+
+def get_registry() -> _Registry:
+    """Registry shared by every Amedas instance in this process
+    """
+    global _registry
+    if _registry is None:
+        if (REGISTRY_DIR / "index.json").exists():
+            _registry = _Registry(REGISTRY_DIR)
+        else:
+            # not split yet, whole list at once
+            import amedas_json
+            _registry = _Registry()
+            _registry.update(amedas_json.amedas_json)
+    return _registry
+
+
 class Amedas():
-    amedas_nodes: typing.Dict[str, AmedasNode] = {}
+    node_class = AmedasNode
+
     def __init__(self) -> None:
-        import amedas_json
-        self.load(amedas_json.amedas_json)
-        # with open("./amedas.json") as f:
-        #     amedas_d = json.load(f)
-        #     self.load(amedas_d)
-    
+        self.registry = get_registry()
+
     def load(self, d:dict):
-        for key, value in d.items():
-            self.amedas_nodes[key] = AmedasNode.load(value)
-    
-    def list(self):
+        self.registry.update(d)
+
+    @property
+    def amedas_nodes(self) -> typing.Dict[str, AmedasNode]:
+        """every node, loads all shards
+        """
+        nodes = {}
+        for prec_no in self.groups():
+            nodes.update(self.registry.shard(self.node_class, prec_no))
+        return nodes
+
+    def groups(self) -> typing.List[str]:
+        """prec_no list
+
+        Returns
+        -------
+        typing.List[str]
+            prec_no
+        """
+        return list(self.registry.extent.keys())
+
+    def list(self, prec_no: typing.Optional[str] = None):
+        if prec_no is not None:
+            return list(self.registry.shard(self.node_class, prec_no).values())
         return list(self.amedas_nodes.values())
     
     def search_oid(self, oid):
-        return self.amedas_nodes.get(oid)
+        prec_no = self.registry.oid2prec.get(oid)
+        if prec_no is None:
+            return None
+        return self.registry.shard(self.node_class, prec_no).get(oid)
 
     def search_blockno(self, blockno):
-        for ams in self.amedas_nodes.values():
-            if ams.block_no == blockno:
-                return ams
+        for oid in self.registry.block2oid.get(blockno, []):
+            return self.search_oid(oid)
 
     def search_name(self, name):
-        for ams in self.amedas_nodes.values():
-            if ams.name == name:
-                return ams
+        for oid in self.registry.name2oid.get(name, []):
+            return self.search_oid(oid)
+
+    def search_near(self, lat: float, lon: float, radius_km: float) -> typing.List[AmedasNode]:
+        """Stations within radius, only matched shards are loaded
+
+        Parameters
+        ----------
+        lat : float
+            latitude (degree)
+        lon : float
+            longitude (degree)
+        radius_km : float
+            radius (km)
+
+        Returns
+        -------
+        typing.List[AmedasNode]
+            nodes sorted by distance
+        """
+        def distance(nlat: float, nlon: float) -> float:
+            # equirectangular approximation is enough for station search
+            x = math.radians(nlon - lon) * math.cos(math.radians((nlat + lat) / 2))
+            y = math.radians(nlat - lat)
+            return 6371.0 * math.hypot(x, y)
+
+        found = []
+        for prec_no, extent in list(self.registry.extent.items()):
+            if extent is None:
+                continue
+            # nearest point of shard extent, skip shards out of radius without reading
+            if distance(min(max(lat, extent[0]), extent[1]), min(max(lon, extent[2]), extent[3])) > radius_km:
+                continue
+            for oid, value in self.registry.raw(prec_no).items():
+                p = _node_latlon(value)
+                if p is None:
+                    continue
+                dist = distance(*p)
+                if dist <= radius_km:
+                    found.append((dist, oid))
+        found.sort()
+        return [self.search_oid(oid) for _, oid in found]
 
 
 if __name__ == '__main__':
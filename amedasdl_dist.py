@@ -0,0 +1,295 @@
+import amedasdl_core
+from amedasdl_core import AmedasError
+from amedasdl_adv import AMeDAS, AmedasDataType
+from amedasdl_job import JobUnit, iter_chunks, load_spec, run_unit
+from amedasdl_writer import WriterSet
+import argparse
+import datetime
+import hashlib
+import os
+import socket
+import sqlite3
+import sys
+import time
+import typing
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    unit_id     TEXT PRIMARY KEY,
+    shard       INTEGER NOT NULL,
+    oid         TEXT NOT NULL,
+    dtype       TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    outputs     TEXT NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    worker      TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    done_at     REAL
+);
+CREATE INDEX IF NOT EXISTS units_state ON units (state, shard, lease_until);
+CREATE TABLE IF NOT EXISTS workers (
+    worker      TEXT PRIMARY KEY,
+    seen        REAL NOT NULL
+);
+"""
+
+
+def unit_id(unit: JobUnit) -> str:
+    return f"{unit.oid}:{unit.dtype.name}:{unit.date.strftime('%Y%m%d')}"
+
+
+def merge_outputs(a: str, b: str) -> str:
+    """Union of comma separated output formats
+    """
+    return ",".join(sorted((set(a.split(",")) | set(b.split(","))) - {""}))
+
+
+def shard_of(uid: str, shards: int) -> int:
+    """Deterministic shard number
+
+    Parameters
+    ----------
+    uid : str
+        unit id
+    shards : int
+        number of shards
+
+    Returns
+    -------
+    int
+        shard number
+    """
+    return int(hashlib.sha1(uid.encode("utf-8")).hexdigest()[:8], 16) % shards
+
+
+class WorkQueue():
+    """Shared Work Queue on SQLite
+
+    Units are leased for a limited time, expired leases return to the queue.
+    Every lease counts as an attempt, so a unit whose worker died is not
+    retried forever.
+
+    The database is shared by file locking of SQLite (WAL mode), which does
+    not work on a network filesystem. Run every worker on the host that
+    holds the file.
+    """
+    def __init__(self, path: str, shards: int = 16, max_attempts: int = 3) -> None:
+        self.path = path
+        self.shards = shards
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.create_function("merge_outputs", 2, merge_outputs, deterministic=True)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def enqueue(self, chunks: typing.Iterable[typing.Tuple[typing.AbstractSet[str], typing.Iterable[JobUnit]]]) -> int:
+        """Add units chunk by chunk, each chunk is committed on its own
+
+        A unit already queued and not done gets the output formats of the
+        new chunk added.
+
+        Parameters
+        ----------
+        chunks : typing.Iterable[typing.Tuple[typing.AbstractSet[str], typing.Iterable[JobUnit]]]
+            output formats and units, like amedasdl_job.iter_chunks
+
+        Returns
+        -------
+        int
+            number of added units
+        """
+        before = self.conn.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+        for outputs, units in chunks:
+            out = ",".join(sorted(outputs))
+            rows = []
+            for u in units:
+                uid = unit_id(u)
+                rows.append((uid, shard_of(uid, self.shards), u.oid, u.dtype.name, u.date.strftime("%Y%m%d"), out))
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("INSERT INTO units (unit_id, shard, oid, dtype, date, outputs) VALUES (?, ?, ?, ?, ?, ?) "
+                                      "ON CONFLICT (unit_id) DO UPDATE SET outputs = merge_outputs(outputs, excluded.outputs) "
+                                      "WHERE state != 'done' AND outputs != excluded.outputs", rows)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.conn.execute("SELECT COUNT(*) FROM units").fetchone()[0] - before
+
+    def lease(self, worker: str, n: int = 16, lease_seconds: float = 300, shards: typing.Optional[typing.List[int]] = None) -> typing.List[typing.Tuple[JobUnit, typing.Set[str]]]:
+        """Lease pending or expired units
+
+        Parameters
+        ----------
+        worker : str
+            worker id
+        n : int, optional
+            max units, by default 16
+        lease_seconds : float, optional
+            lease time, by default 300
+        shards : typing.Optional[typing.List[int]], optional
+            lease only from these shards, by default any
+
+        Returns
+        -------
+        typing.List[typing.Tuple[JobUnit, typing.Set[str]]]
+            leased units and output formats
+        """
+        now = time.time()
+        where = "(state = 'pending' OR (state = 'leased' AND lease_until < ?))"
+        params: list = [now]
+        if shards:
+            where += f" AND shard IN ({','.join('?' * len(shards))})"
+            params += list(shards)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # expired after the last attempt, the worker died on it
+            self.conn.execute("UPDATE units SET state = 'failed' WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, self.max_attempts))
+            rows = self.conn.execute(f"SELECT unit_id, oid, dtype, date, outputs FROM units WHERE {where} ORDER BY shard, oid, dtype, date LIMIT ?", params + [n]).fetchall()
+            self.conn.executemany("UPDATE units SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE unit_id = ?", [(worker, now + lease_seconds, r[0]) for r in rows])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        leased = []
+        for _, oid, dtype, date, outputs in rows:
+            u = JobUnit(oid, AmedasDataType[dtype], datetime.datetime.strptime(date, "%Y%m%d").date())
+            leased.append((u, set(o for o in outputs.split(",") if o)))
+        return leased
+
+    def complete(self, worker: str, unit: JobUnit) -> bool:
+        """Mark unit done, False if the lease was lost to another worker
+        """
+        cur = self.conn.execute("UPDATE units SET state = 'done', done_at = ? WHERE unit_id = ? AND worker = ? AND state = 'leased'", (time.time(), unit_id(unit), worker))
+        return cur.rowcount > 0
+
+    def fail(self, worker: str, unit: JobUnit) -> None:
+        self.conn.execute("UPDATE units SET lease_until = 0, state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END WHERE unit_id = ? AND worker = ? AND state = 'leased'", (self.max_attempts, unit_id(unit), worker))
+
+    def renew(self, worker: str, lease_seconds: float = 300) -> None:
+        """Extend every lease held by worker
+        """
+        self.conn.execute("UPDATE units SET lease_until = ? WHERE worker = ? AND state = 'leased'", (time.time() + lease_seconds, worker))
+
+    def heartbeat(self, worker: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO workers (worker, seen) VALUES (?, ?)", (worker, time.time()))
+
+    def active_workers(self, ttl: float = 120) -> int:
+        row = self.conn.execute("SELECT COUNT(*) FROM workers WHERE seen >= ?", (time.time() - ttl,)).fetchone()
+        return max(1, row[0])
+
+    def remaining(self) -> int:
+        row = self.conn.execute("SELECT COUNT(*) FROM units WHERE state IN ('pending', 'leased')").fetchone()
+        return row[0]
+
+    def status(self) -> typing.Dict[str, int]:
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM units GROUP BY state").fetchall())
+
+
+def work(ams: AMeDAS, queue: WorkQueue, worker: str, global_rate: float = 1.0, batch: int = 16, lease_seconds: float = 300, shards: typing.Optional[typing.List[int]] = None, ttl: float = 120) -> int:
+    """Worker loop, run until the queue is drained
+
+    Parameters
+    ----------
+    ams : AMeDAS
+        registry
+    queue : WorkQueue
+        shared queue
+    worker : str
+        worker id
+    global_rate : float, optional
+        request per second for all workers, by default 1.0
+    batch : int, optional
+        max units per lease, by default 16, smaller if the batch would not
+        finish within lease_seconds at the own request rate
+    lease_seconds : float, optional
+        lease time, by default 300
+    shards : typing.Optional[typing.List[int]], optional
+        lease only from these shards, by default any
+    ttl : float, optional
+        worker is active if heartbeat within this seconds, by default 120
+
+    Returns
+    -------
+    int
+        number of completed units
+    """
+    done = 0
+    with WriterSet({"csvbulk": {"label": worker}, "jsonl": {"label": worker}, "parquet": {"label": worker}}) as writer_set:
+        while True:
+            queue.heartbeat(worker)
+            # own slice of global budget
+            interval = queue.active_workers(ttl) / global_rate
+            amedasdl_core.rate_limiter.interval = interval
+            n = max(1, min(batch, int(lease_seconds / 2 / interval)))
+            leased = queue.lease(worker, n, lease_seconds, shards)
+            if not leased:
+                if queue.remaining() == 0:
+                    break
+                time.sleep(min(lease_seconds, 10))
+                continue
+            for u, outputs in leased:
+                node = ams.search_oid(u.oid)
+                try:
+                    if node is None:
+                        raise AmedasError(f"Not Found OID:{u.oid}")
+                    run_unit(node, u, outputs, writer_set)
+                except (AmedasError, Exception) as e:
+                    print(f"[WARNING] {unit_id(u)} : {type(e).__name__} {e}")
+                    queue.fail(worker, u)
+                    queue.renew(worker, lease_seconds)
+                    continue
+                if queue.complete(worker, u):
+                    done += 1
+                else:
+                    print(f"[WARNING] {unit_id(u)} : lease expired, taken by another worker")
+                queue.renew(worker, lease_seconds)
+                queue.heartbeat(worker)
+    return done
+
+
+def getOption():
+    parser = argparse.ArgumentParser(description="分散ダウンロード 共有キューへの登録と取得ワーカー")
+    parser.add_argument("--db",
+                        type=str,
+                        metavar="Queue DB",
+                        default="amedas_queue.sqlite",
+                        help="共有キュー（SQLite）のパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enq = sub.add_parser("enqueue", help="ジョブ定義ファイルをキューに登録する")
+    enq.add_argument("spec", type=str, help="ジョブ定義ファイル")
+    enq.add_argument("--shards", type=int, default=16, help="シャード数")
+    wk = sub.add_parser("work", help="キューが空になるまで取得する")
+    wk.add_argument("--worker", type=str, default=f"{socket.gethostname()}-{os.getpid()}", help="ワーカーID")
+    wk.add_argument("--rate", type=float, default=1.0, help="全ワーカー合計のリクエスト数/秒")
+    wk.add_argument("--batch", type=int, default=16, help="1回に借りる件数")
+    wk.add_argument("--lease", type=float, default=300, help="貸出期限（秒）")
+    wk.add_argument("--shard", type=str, default=None, help="担当シャード カンマ区切り")
+    sub.add_parser("status", help="キューの状態を表示する")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = getOption()
+    if opt.command == "enqueue":
+        queue = WorkQueue(opt.db, opt.shards)
+        n = queue.enqueue(iter_chunks(AMeDAS(), load_spec(opt.spec)))
+        print(f"[Info] {n} units queued")
+    elif opt.command == "work":
+        queue = WorkQueue(opt.db)
+        shards = [int(x) for x in opt.shard.split(",")] if opt.shard else None
+        n = work(AMeDAS(), queue, opt.worker, opt.rate, opt.batch, opt.lease, shards)
+        print(f"[Info] {n} units done")
+    else:
+        queue = WorkQueue(opt.db)
+        for state, count in queue.status().items():
+            print(f"{state:8s}: {count}")
+    queue.close()
+    sys.exit(0)
@@ -0,0 +1,352 @@
+import amedasdl_core
+from amedasdl_core import AdaptiveRateLimiter, AmedasError
+from amedasdl_adv import AMeDAS, AMeDASNode, AmedasDataType
+from amedasdl_plan import PAGE_SPAN, iter_plan, last_complete_date, node_end_date, parse_date
+from amedasdl_writer import WriterSet, available_writers, save_page
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import datetime
+import itertools
+import json
+import sys
+import typing
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+class JobUnit(typing.NamedTuple):
+    """One page download
+    """
+    oid: str
+    dtype: AmedasDataType
+    date: datetime.date
+
+
+def load_spec(path: str) -> dict:
+    """Load job spec file (json, toml, yaml)
+
+    Parameters
+    ----------
+    path : str
+        spec file path
+
+    Returns
+    -------
+    dict
+        spec
+
+    Raises
+    ------
+    AmedasError
+        unknown format or missing parser
+    """
+    p = Path(path)
+    suffix = p.suffix.lower()
+    if suffix == ".json":
+        with open(p, encoding="utf-8") as f:
+            return json.load(f)
+    if suffix == ".toml":
+        import tomllib
+        with open(p, "rb") as f:
+            return tomllib.load(f)
+    if suffix in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise AmedasError("install pyyaml with pip for YAML job spec")
+        with open(p, encoding="utf-8") as f:
+            return yaml.safe_load(f)
+    raise AmedasError(f"Not Support Job Spec Format {suffix}")
+
+
+def node_oid(node: AMeDASNode) -> str:
+    return f"{node.prec_no}{node.block_no}"
+
+
+def _as_list(v) -> typing.List[str]:
+    if v is None:
+        return []
+    if isinstance(v, (list, tuple)):
+        return [str(x) for x in v]
+    return [x for x in str(v).split(",") if x]
+
+
+def _parse_date(v) -> datetime.date:
+    if isinstance(v, datetime.date):
+        return v if not isinstance(v, datetime.datetime) else v.date()
+    return parse_date(str(v))
+
+
+def select_nodes(ams: AMeDAS, job: dict) -> typing.List[AMeDASNode]:
+    """Resolve station selectors of one job
+
+    Parameters
+    ----------
+    ams : AMeDAS
+        registry
+    job : dict
+        job entry, keys "oid", "bid", "name", "prec_no"
+
+    Returns
+    -------
+    typing.List[AMeDASNode]
+        nodes
+    """
+    nodes = []
+    for oid in _as_list(job.get("oid")):
+        a = ams.search_oid(oid)
+        if a is None:
+            print(f"Not Found OID:{oid}")
+        else:
+            nodes.append(a)
+    for bid in _as_list(job.get("bid")):
+        a = ams.search_blockno(bid)
+        if a is None:
+            print(f"Not Found ID:{bid}")
+        else:
+            nodes.append(a)
+    for name in _as_list(job.get("name")):
+        a = ams.search_name(name)
+        if a is None:
+            print(f"Not Found Name {name}")
+        else:
+            nodes.append(a)
+    for prec_no in _as_list(job.get("prec_no")):
+        nodes += ams.list(prec_no)
+    return nodes
+
+
+def job_pages(nodes: typing.List[AMeDASNode], dtypes: typing.List[AmedasDataType], job: dict) -> typing.Iterator[typing.Tuple[AMeDASNode, AmedasDataType, datetime.date]]:
+    """Pages of one job, "dates" list or "start"/"end" (end is exclusive)
+
+    Pages are yielded station by station, dates are checked at call.
+
+    Parameters
+    ----------
+    nodes : typing.List[AMeDASNode]
+        stations
+    dtypes : typing.List[AmedasDataType]
+        Data Types
+    job : dict
+        job entry
+
+    Returns
+    -------
+    typing.Iterator[typing.Tuple[AMeDASNode, AmedasDataType, datetime.date]]
+        pages
+    """
+    if "dates" not in job:
+        return iter_plan(nodes, dtypes, _parse_date(job["start"]), _parse_date(job["end"]))
+    last = last_complete_date()
+    dates = []
+    for d in sorted(set(_parse_date(d) for d in job["dates"])):
+        if d > last:
+            print(f"[WARNING] NOT Use today in date {d}")
+        else:
+            dates.append(d)
+
+    def pages():
+        for a in nodes:
+            stop = node_end_date(a)
+            for dtype in dtypes:
+                span = PAGE_SPAN[dtype]
+                for d in dates:
+                    if stop is not None and d > stop:
+                        continue
+                    if span == "all":
+                        d = dates[0]
+                    elif span == "month":
+                        d = d.replace(day=1)
+                    elif span == "year":
+                        d = d.replace(month=1, day=1)
+                    yield a, dtype, d
+    return pages()
+
+
+def iter_chunks(ams: AMeDAS, spec: dict) -> typing.Iterator[typing.Tuple[typing.FrozenSet[str], typing.List[JobUnit]]]:
+    """Units of job spec, one station of one job at a time
+
+    Parameters
+    ----------
+    ams : AMeDAS
+        registry
+    spec : dict
+        job spec
+
+    Returns
+    -------
+    typing.Iterator[typing.Tuple[typing.FrozenSet[str], typing.List[JobUnit]]]
+        output formats shared by the chunk and units of the chunk
+    """
+    writers = set(available_writers())
+    for i, job in enumerate(spec.get("jobs", [])):
+        nodes = select_nodes(ams, job)
+        dtypes = []
+        for t in _as_list(job.get("dtype", "TenMinutes")):
+            try:
+                dtypes.append(AmedasDataType[t.upper()])
+            except KeyError:
+                print(f"Not Support Data Tyep of {t}")
+        outputs = set(_as_list(job.get("output", "csv")))
+        for o in outputs - writers:
+            print(f"Not Support Output Format {o}")
+        outputs = frozenset(outputs & writers)
+        # a bad job is skipped, same as a future date in "dates"
+        try:
+            pages = job_pages(nodes, dtypes, job)
+        except AmedasError as e:
+            print(f"[WARNING] Skip jobs[{i}] : {e}")
+            continue
+        except KeyError as e:
+            print(f"[WARNING] Skip jobs[{i}] : {e} is required without \"dates\"")
+            continue
+        for a, pages in itertools.groupby(pages, key=lambda p: p[0]):
+            oid = node_oid(a)
+            yield outputs, [JobUnit(oid, d, date) for _, d, date in pages]
+
+
+def expand(ams: AMeDAS, spec: dict) -> typing.Dict[JobUnit, typing.FrozenSet[str]]:
+    """Expand job spec to deduplicated units
+
+    Parameters
+    ----------
+    ams : AMeDAS
+        registry
+    spec : dict
+        job spec
+
+    Returns
+    -------
+    typing.Dict[JobUnit, typing.FrozenSet[str]]
+        unit to output formats, units of one job share one set
+    """
+    units: typing.Dict[JobUnit, typing.FrozenSet[str]] = {}
+    for outputs, chunk in iter_chunks(ams, spec):
+        for u in chunk:
+            prev = units.get(u)
+            if prev is None:
+                units[u] = outputs
+            elif not outputs <= prev:
+                units[u] = prev | outputs
+    return units
+
+
+def group_units(units: typing.Dict[JobUnit, typing.AbstractSet[str]]) -> typing.List[typing.List[JobUnit]]:
+    """Group units per station and order by dtype and date
+
+    Parameters
+    ----------
+    units : typing.Dict[JobUnit, typing.AbstractSet[str]]
+        expanded units
+
+    Returns
+    -------
+    typing.List[typing.List[JobUnit]]
+        units per station, largest group first
+    """
+    dtype_order = {d: i for i, d in enumerate(AmedasDataType)}
+    groups: typing.Dict[str, typing.List[JobUnit]] = {}
+    for u in units:
+        groups.setdefault(u.oid, []).append(u)
+    for g in groups.values():
+        g.sort(key=lambda u: (dtype_order[u.dtype], u.date))
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def run_unit(node: AMeDASNode, unit: JobUnit, outputs: typing.AbstractSet[str], writer_set: WriterSet) -> None:
+    """Download one page once and write to every output
+
+    Parameters
+    ----------
+    node : AMeDASNode
+        node
+    unit : JobUnit
+        unit
+    outputs : typing.AbstractSet[str]
+        output formats
+    writer_set : WriterSet
+        writers shared by every unit
+    """
+    save_page(node, unit.dtype, unit.date, sorted(outputs), writer_set)
+
+
+def run(ams: AMeDAS, units: typing.Dict[JobUnit, typing.AbstractSet[str]], writer_set: WriterSet, workers: int = 4) -> typing.List[JobUnit]:
+    """Run units concurrently, one station per task
+
+    Parameters
+    ----------
+    ams : AMeDAS
+        registry
+    units : typing.Dict[JobUnit, typing.AbstractSet[str]]
+        expanded units
+    writer_set : WriterSet
+        writers shared by every unit
+    workers : int, optional
+        number of threads, by default 4
+
+    Returns
+    -------
+    typing.List[JobUnit]
+        failed units
+    """
+    failed: typing.List[JobUnit] = []
+
+    def run_group(group: typing.List[JobUnit]):
+        node = ams.search_oid(group[0].oid)
+        for u in group:
+            try:
+                run_unit(node, u, units[u], writer_set)
+            except (AmedasError, Exception) as e:
+                print(f"[WARNING] {u.oid} {u.dtype.name} {u.date} : {type(e).__name__} {e}")
+                failed.append(u)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for f in [executor.submit(run_group, g) for g in group_units(units)]:
+            f.result()
+    return failed
+
+
+def run_spec(ams: AMeDAS, path: str) -> int:
+    """Run job spec file
+
+    Parameters
+    ----------
+    ams : AMeDAS
+        registry
+    path : str
+        spec file path
+
+    Returns
+    -------
+    int
+        exit code
+    """
+    spec = load_spec(path)
+    units = expand(ams, spec)
+    print(f"[Info] {len(units)} pages")
+    workers = spec.get("workers", 4)
+    limiter = None
+    if "rate" in spec:
+        # {"max_rate": 5, "max_concurrency": 8, "target_p95": 2.0, ...}
+        limiter = AdaptiveRateLimiter(**spec["rate"])
+        amedasdl_core.rate_limiter = limiter
+        workers = max(workers, limiter.max_concurrency)
+    # {"jsonl": {"label": "nightly"}, "sqlite": {"path": "./amedas.sqlite"}}
+    options = dict(spec.get("writers", {}))
+    bulk = spec.get("bulk", {})
+    options.setdefault("csvbulk", {"label": bulk.get("label", Path(path).stem), "gzip": bulk.get("gzip", False), "flush": bulk.get("flush", 0)})
+    with WriterSet(options) as writer_set:
+        failed = run(ams, units, writer_set, workers)
+    if limiter is not None:
+        print(f"[Info] Final Rate {limiter.rate:.2f} req/s, concurrency {limiter.concurrency}")
+    if failed:
+        print(f"[WARNING] {len(failed)} pages failed")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} JOBSPEC")
+        sys.exit(1)
+    sys.exit(run_spec(AMeDAS(), sys.argv[1]))
@@ -0,0 +1,177 @@
+from amedasdl_core import AmedasDataType, AmedasError, AmedasNode, jst_today
+import bisect
+import datetime
+import typing
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+# one page covers this span
+PAGE_SPAN = {
+    AmedasDataType.ANNUAL: "all",
+    AmedasDataType.THREEMONTH: "all",
+    AmedasDataType.ALLMONTH: "all",
+    AmedasDataType.YEARMONTH: "year",
+    AmedasDataType.TENDAYS: "year",
+    AmedasDataType.FIVEDAYS: "year",
+    AmedasDataType.DAY: "month",
+    AmedasDataType.HOUR: "day",
+    AmedasDataType.TENMINUTES: "day",
+}
+
+
+def parse_date(text: str) -> datetime.date:
+    """Parse "YYYYMMDD"
+
+    Raises
+    ------
+    AmedasError
+        invalid date
+    """
+    try:
+        return datetime.datetime.strptime(text, "%Y%m%d").date()
+    except ValueError:
+        raise AmedasError(f"Invalid Date {text}, use YYYYMMDD")
+
+
+def last_complete_date(today: typing.Optional[datetime.date] = None) -> datetime.date:
+    """Last day which data is complete, yesterday in JST
+
+    Parameters
+    ----------
+    today : typing.Optional[datetime.date], optional
+        today (JST), by default now
+
+    Returns
+    -------
+    datetime.date
+        yesterday (JST)
+    """
+    return (today or jst_today()) - datetime.timedelta(days=1)
+
+
+def node_end_date(node: AmedasNode) -> typing.Optional[datetime.date]:
+    """Last observation date, None if still continued
+
+    Parameters
+    ----------
+    node : AmedasNode
+        node
+
+    Returns
+    -------
+    typing.Optional[datetime.date]
+        stop date
+    """
+    if node.ed_y == 9999 or node.ed_m == 99 or node.ed_d == 99:
+        return None
+    try:
+        return datetime.date(node.ed_y, node.ed_m, node.ed_d)
+    except ValueError:
+        return None
+
+
+def validate_range(start: datetime.date, end: datetime.date, today: typing.Optional[datetime.date] = None) -> datetime.date:
+    """Check date range before any download
+
+    Parameters
+    ----------
+    start : datetime.date
+        first date
+    end : datetime.date
+        end date (exclusive)
+    today : typing.Optional[datetime.date], optional
+        today (JST), by default now
+
+    Returns
+    -------
+    datetime.date
+        end date clipped to last complete day (exclusive)
+
+    Raises
+    ------
+    AmedasError
+        empty range or start is not complete yet
+    """
+    if start >= end:
+        raise AmedasError(f"StartDate {start} must be before EndDate {end}")
+    limit = last_complete_date(today) + datetime.timedelta(days=1)
+    if start >= limit:
+        raise AmedasError(f"NOT Use today in date, StartDate {start} must be before {limit} (JST)")
+    if end > limit:
+        print(f"[Info] EndDate clipped to {limit} (JST)")
+        end = limit
+    return end
+
+
+def date_axis(start: datetime.date, end: datetime.date) -> typing.Dict[str, typing.List[datetime.date]]:
+    """Page dates of every span for the range in one pass
+
+    Parameters
+    ----------
+    start : datetime.date
+        first date
+    end : datetime.date
+        end date (exclusive)
+
+    Returns
+    -------
+    typing.Dict[str, typing.List[datetime.date]]
+        sorted page dates for "day", "month", "year" and "all"
+    """
+    days = [datetime.date.fromordinal(o) for o in range(start.toordinal(), end.toordinal())]
+    months = sorted(set(d.replace(day=1) for d in days))
+    years = sorted(set(d.replace(month=1) for d in months))
+    return {"day": days, "month": months, "year": years, "all": days[:1]}
+
+
+def iter_plan(nodes: typing.Iterable[AmedasNode], dtypes: typing.Iterable[AmedasDataType], start: datetime.date, end: datetime.date, today: typing.Optional[datetime.date] = None) -> typing.Iterator[typing.Tuple[AmedasNode, AmedasDataType, datetime.date]]:
+    """Same as plan, but units are yielded one by one
+
+    The range is validated at call, before the first unit is taken.
+    """
+    end = validate_range(start, end, today)
+    axis = date_axis(start, end)
+    dtypes = list(dtypes)
+
+    def units():
+        for node in nodes:
+            stop = node_end_date(node)
+            for dtype in dtypes:
+                pages = axis[PAGE_SPAN[dtype]]
+                n = len(pages) if stop is None else bisect.bisect_right(pages, stop)
+                for d in pages[:n]:
+                    yield node, dtype, d
+    return units()
+
+
+def plan(nodes: typing.Iterable[AmedasNode], dtypes: typing.Iterable[AmedasDataType], start: datetime.date, end: datetime.date, today: typing.Optional[datetime.date] = None) -> typing.List[typing.Tuple[AmedasNode, AmedasDataType, datetime.date]]:
+    """Plan every (station, dtype, page date) to download
+
+    Dates are JST calendar dates. Each station is clipped to its stop date
+    and each dtype to the page span (one page per day, month, year or all).
+
+    Parameters
+    ----------
+    nodes : typing.Iterable[AmedasNode]
+        stations
+    dtypes : typing.Iterable[AmedasDataType]
+        Data Types
+    start : datetime.date
+        first date
+    end : datetime.date
+        end date (exclusive)
+    today : typing.Optional[datetime.date], optional
+        today (JST), by default now
+
+    Returns
+    -------
+    typing.List[typing.Tuple[AmedasNode, AmedasDataType, datetime.date]]
+        work units ordered by station, dtype, date
+
+    Raises
+    ------
+    AmedasError
+        invalid range
+    """
+    return list(iter_plan(nodes, dtypes, start, end, today))
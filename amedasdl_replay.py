@@ -0,0 +1,332 @@
+import amedasdl_core
+from amedasdl_core import AdaptiveRateLimiter, AmedasDataType, AmedasError, AmedasHTTPError, HttpTransport, RateLimiter
+from amedasdl_adv import AMeDAS
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import contextlib
+import datetime
+import hashlib
+import os
+import random
+import threading
+import time
+import typing
+import urllib.parse
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+
+def page_key(url: str) -> str:
+    """Host independent key of page url
+
+    Parameters
+    ----------
+    url : str
+        url or request path
+
+    Returns
+    -------
+    str
+        "path?query"
+    """
+    u = urllib.parse.urlsplit(url)
+    return f"{u.path}?{u.query}"
+
+
+def page_file(store: Path, url: str) -> Path:
+    return store / (hashlib.sha1(page_key(url).encode("utf-8")).hexdigest() + ".html")
+
+
+class RecordTransport():
+    """Fetch by inner transport and save every page to store
+    """
+    def __init__(self, store: str, inner=None) -> None:
+        self.store = Path(store)
+        self.store.mkdir(parents=True, exist_ok=True)
+        self.inner = inner or HttpTransport()
+
+    def get(self, url: str) -> str:
+        html = self.inner.get(url)
+        with open(page_file(self.store, url), "w", encoding="utf-8") as f:
+            f.write(html)
+        return html
+
+
+class ReplayTransport():
+    """Read recorded pages from store, no network access
+    """
+    def __init__(self, store: str) -> None:
+        self.store = Path(store)
+
+    def get(self, url: str) -> str:
+        path = page_file(self.store, url)
+        if not path.exists():
+            raise AmedasError(f"Not Recorded : {url}")
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+
+def install(transport) -> None:
+    """Replace fetch layer of amedasdl_core
+
+    Parameters
+    ----------
+    transport : object
+        object with get(url) -> str
+    """
+    amedasdl_core.transport = transport
+
+
+def synthesize_page(path: str) -> str:
+    """Dummy page with the table shape of TENMINUTES/HOUR pages
+
+    Parameters
+    ----------
+    path : str
+        request path
+
+    Returns
+    -------
+    str
+        html text
+    """
+    name = path.rsplit("/", 1)[-1]
+    headers = 2
+    if name.startswith("10min_"):
+        times = [f"{i // 6:02d}:{i % 6 * 10:02d}" for i in range(1, 145)]
+        ncols = 11 if name.startswith("10min_s") else 9
+        headers = 2 if name.startswith("10min_s") else 3
+    else:
+        times = [str(i) for i in range(1, 25)]
+        ncols = 17 if name.startswith("hourly_s") else 11
+    rows = ["<tr><th>-</th></tr>"] * headers
+    for t in times:
+        rows.append("<tr><td>" + t + "</td>" + "<td>0.0</td>" * (ncols - 1) + "</tr>")
+    return '<html><body><table id="tablefix1">' + "".join(rows) + "</table></body></html>"
+
+
+class FaultInjector():
+    """Deterministic latency, error and throttling injection
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, max_rps: float = 0.0, seed: int = 0) -> None:
+        """
+        Parameters
+        ----------
+        latency : float, optional
+            base response delay seconds, by default 0.0
+        jitter : float, optional
+            uniform random extra delay seconds, by default 0.0
+        error_rate : float, optional
+            probability of 503 response, by default 0.0
+        max_rps : float, optional
+            requests per second over this get 429, 0 is no limit, by default 0.0
+        seed : int, optional
+            random seed, by default 0
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__tokens = max_rps
+        self.__last = time.monotonic()
+
+    def decide(self) -> typing.Tuple[float, int]:
+        """delay and status code of next response
+        """
+        with self.__lock:
+            delay = self.latency + self.__random.uniform(0, self.jitter)
+            error = self.__random.random() < self.error_rate
+            if self.max_rps > 0:
+                now = time.monotonic()
+                self.__tokens = min(self.max_rps, self.__tokens + (now - self.__last) * self.max_rps)
+                self.__last = now
+                if self.__tokens < 1:
+                    return 0.0, 429
+                self.__tokens -= 1
+        return delay, 503 if error else 200
+
+
+def make_server(store: str, host: str = "127.0.0.1", port: int = 8000, faults: typing.Optional[FaultInjector] = None, synthesize: bool = False) -> ThreadingHTTPServer:
+    """Local stand-in server for the JMA site
+
+    Serves recorded pages by the same path and query as the original url.
+
+    Parameters
+    ----------
+    store : str
+        recorded page directory
+    host : str, optional
+        bind address, by default "127.0.0.1"
+    port : int, optional
+        port, by default 8000
+    faults : typing.Optional[FaultInjector], optional
+        fault injection, by default None
+    synthesize : bool, optional
+        answer dummy table page for not recorded url, by default False
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        server, call serve_forever()
+    """
+    store_path = Path(store)
+    injector = faults or FaultInjector()
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            delay, status = injector.decide()
+            if delay > 0:
+                time.sleep(delay)
+            body = None
+            if status == 200:
+                path = page_file(store_path, self.path)
+                if path.exists():
+                    body = path.read_bytes()
+                elif synthesize:
+                    body = synthesize_page(urllib.parse.urlsplit(self.path).path).encode("utf-8")
+                else:
+                    status = 404
+            if body is None:
+                body = f"<html><body>{status}</body></html>".encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    return server
+
+
+class _CountingTransport():
+    """Count raw responses of inner transport
+    """
+    def __init__(self, inner) -> None:
+        self.inner = inner
+        self.attempts = 0
+        self.throttled = 0
+        self.__lock = threading.Lock()
+
+    def get(self, url: str) -> str:
+        try:
+            return self.inner.get(url)
+        except AmedasHTTPError as e:
+            if e.status in (429, 503):
+                with self.__lock:
+                    self.throttled += 1
+            raise
+        finally:
+            with self.__lock:
+                self.attempts += 1
+
+
+def bench(baseurl: str, requests: int = 1000, workers: int = 16, interval: float = 0.0, max_rate: typing.Optional[float] = None) -> typing.Dict[str, float]:
+    """Throughput of download scheduling against local server
+
+    Pages are fetched by AmedasNode.download, so the shared rate limiter
+    and the 429/503 retry are included.
+
+    Parameters
+    ----------
+    baseurl : str
+        server url like "http://127.0.0.1:8000/obd/stats/etrn/view/"
+    requests : int, optional
+        number of pages, by default 1000
+    workers : int, optional
+        number of threads, by default 16
+    interval : float, optional
+        fixed rate limiter interval seconds, by default 0.0
+    max_rate : typing.Optional[float], optional
+        use AdaptiveRateLimiter with this ceiling instead, by default None
+
+    Returns
+    -------
+    typing.Dict[str, float]
+        "ok", "error", "attempts", "throttled", "seconds", "rps", "rate"
+    """
+    nodes = AMeDAS().list()
+    saved = (amedasdl_core.AMEDAS_BASEURL, amedasdl_core.transport, amedasdl_core.rate_limiter)
+    counter = _CountingTransport(amedasdl_core.transport)
+    if max_rate is not None:
+        limiter = AdaptiveRateLimiter(max_rate=max_rate, max_concurrency=workers, start_rate=min(1.0, max_rate))
+    else:
+        limiter = RateLimiter(interval)
+    amedasdl_core.AMEDAS_BASEURL = baseurl
+    amedasdl_core.transport = counter
+    amedasdl_core.rate_limiter = limiter
+    result = {"ok": 0, "error": 0}
+    lock = threading.Lock()
+    first = datetime.date(2000, 1, 1)
+
+    def one(i: int):
+        node = nodes[i % len(nodes)]
+        try:
+            node.download(AmedasDataType.TENMINUTES, first + datetime.timedelta(days=i // len(nodes)))
+            key = "ok"
+        except (AmedasError, Exception):
+            key = "error"
+        with lock:
+            result[key] += 1
+
+    start = time.monotonic()
+    try:
+        # download() prints every url
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(one, range(requests)))
+    finally:
+        amedasdl_core.AMEDAS_BASEURL, amedasdl_core.transport, amedasdl_core.rate_limiter = saved
+    result["seconds"] = time.monotonic() - start
+    result["rps"] = requests / result["seconds"]
+    result["attempts"] = counter.attempts
+    result["throttled"] = counter.throttled
+    result["rate"] = limiter.rate if max_rate is not None else (1.0 / interval if interval > 0 else 0.0)
+    return result
+
+
+def getOption():
+    parser = argparse.ArgumentParser(description="記録済みページを返すローカルサーバーと負荷試験")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sv = sub.add_parser("serve", help="記録済みページを同じURL形式で返すサーバー")
+    sv.add_argument("--store", type=str, default="./record", help="記録ディレクトリ")
+    sv.add_argument("--host", type=str, default="127.0.0.1")
+    sv.add_argument("--port", type=int, default=8000)
+    sv.add_argument("--latency", type=float, default=0.0, help="応答遅延（秒）")
+    sv.add_argument("--jitter", type=float, default=0.0, help="応答遅延のゆらぎ（秒）")
+    sv.add_argument("--error-rate", type=float, default=0.0, help="503を返す確率")
+    sv.add_argument("--max-rps", type=float, default=0.0, help="超えたら429を返すリクエスト数/秒 0は無制限")
+    sv.add_argument("--seed", type=int, default=0)
+    sv.add_argument("--synthesize", action="store_true", help="記録に無いページにはダミーの表を返す")
+    bn = sub.add_parser("bench", help="サーバーに対するスループットを計測する")
+    bn.add_argument("--url", type=str, default="http://127.0.0.1:8000/obd/stats/etrn/view/")
+    bn.add_argument("-n", "--requests", type=int, default=1000)
+    bn.add_argument("-w", "--workers", type=int, default=16)
+    bn.add_argument("--interval", type=float, default=0.0, help="固定のリクエスト間隔（秒）")
+    bn.add_argument("--max-rate", type=float, default=None, help="自動調整するリクエスト数/秒の上限")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = getOption()
+    if opt.command == "serve":
+        faults = FaultInjector(opt.latency, opt.jitter, opt.error_rate, opt.max_rps, opt.seed)
+        server = make_server(opt.store, opt.host, opt.port, faults, opt.synthesize)
+        print(f"Serving {opt.store} on http://{opt.host}:{opt.port}/obd/stats/etrn/view/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        r = bench(opt.url, opt.requests, opt.workers, opt.interval, opt.max_rate)
+        print(f"ok {r['ok']}  error {r['error']}  attempts {r['attempts']}  throttled {r['throttled']}  {r['seconds']:.2f}s  {r['rps']:.1f} req/s")
@@ -0,0 +1,305 @@
+from amedasdl_core import AmedasDataType, AmedasError
+from amedasdl_agg import EXPECTED_ROWS, FLAG_MISSING, column_kind, parse_direction, parse_value
+from amedasdl_check import STEPS
+from array import array
+from pathlib import Path
+import argparse
+import csv
+import datetime
+import json
+import math
+import mmap
+import sys
+import typing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+# Archive of one station and dtype
+#   {block_no}_{DTYPE}.json  metadata (columns, start date, rows per day)
+#   {block_no}_{DTYPE}.f32   float32 [day][row][column], NaN is missing
+#   {block_no}_{DTYPE}.q8    uint8   [day][row][column], quality flag of amedasdl_agg
+# Wind direction is stored in degree.
+
+
+def archive_stem(root: Path, block_no: str, dtype: AmedasDataType) -> Path:
+    return Path(root) / f"{block_no}_{dtype.name}"
+
+
+def row_slot(cell: str, dtype: AmedasDataType) -> typing.Optional[int]:
+    """Row index in a day from page time column
+
+    Parameters
+    ----------
+    cell : str
+        "HH:MM" (TENMINUTES, 00:10 - 24:00) or "H" (HOUR, 1 - 24)
+    dtype : AmedasDataType
+        TENMINUTES or HOUR
+
+    Returns
+    -------
+    typing.Optional[int]
+        0 for the first observation of the day, None if not a time of the day
+    """
+    try:
+        if ":" in cell:
+            hour, minute = cell.split(":", 1)
+            minutes = int(hour) * 60 + int(minute)
+        else:
+            minutes = int(cell) * 60
+    except ValueError:
+        return None
+    step = int(STEPS[dtype].total_seconds()) // 60
+    if minutes % step != 0 or not 0 < minutes <= 24 * 60:
+        return None
+    return minutes // step - 1
+
+
+class ArchiveWriter():
+    """Write per-day tables into fixed-width archive
+    """
+    def __init__(self, root: str, block_no: str, dtype: AmedasDataType, header: typing.List[str], start: datetime.date) -> None:
+        """
+        Parameters
+        ----------
+        root : str
+            archive directory
+        block_no : str
+            block number
+        dtype : AmedasDataType
+            TENMINUTES or HOUR
+        header : typing.List[str]
+            csv header, first (time) column is not stored
+        start : datetime.date
+            first date, used only when the archive is new
+        """
+        if dtype not in EXPECTED_ROWS:
+            raise AmedasError(f"Not Support {dtype.name} for archive")
+        self.stem = archive_stem(root, block_no, dtype)
+        self.stem.parent.mkdir(parents=True, exist_ok=True)
+        meta_path = self.stem.with_suffix(".json")
+        if meta_path.exists():
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if header[1:] != self.meta["columns"]:
+                raise AmedasError(f"Columns {header[1:]} do not match archive {self.stem} {self.meta['columns']}")
+        else:
+            self.meta = {
+                "block_no": block_no,
+                "dtype": dtype.name,
+                "columns": header[1:],
+                "start": start.strftime("%Y%m%d"),
+                "rows_per_day": EXPECTED_ROWS[dtype],
+            }
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(self.meta, f, ensure_ascii=False)
+            self.stem.with_suffix(".f32").touch()
+            self.stem.with_suffix(".q8").touch()
+        self.dtype = dtype
+        self.start = datetime.datetime.strptime(self.meta["start"], "%Y%m%d").date()
+        self.rows = self.meta["rows_per_day"]
+        self.ncols = len(self.meta["columns"])
+        self.kinds = [column_kind(c) for c in self.meta["columns"]]
+        self.__values = open(self.stem.with_suffix(".f32"), "r+b")
+        self.__flags = open(self.stem.with_suffix(".q8"), "r+b")
+
+    def __pad(self, ndays: int) -> None:
+        # fill days not written yet as missing
+        cells = self.rows * self.ncols
+        have = self.__flags.seek(0, 2) // cells
+        if have >= ndays:
+            return
+        self.__values.seek(have * cells * 4)
+        self.__values.write(array("f", [math.nan] * cells).tobytes() * (ndays - have))
+        self.__flags.seek(have * cells)
+        self.__flags.write(bytes([FLAG_MISSING]) * cells * (ndays - have))
+
+    def write_day(self, date: datetime.date, table: typing.List[typing.List[str]]) -> None:
+        """Write or overwrite one day
+
+        Parameters
+        ----------
+        date : datetime.date
+            page date
+        table : typing.List[typing.List[str]]
+            parsed table (without header), rows are placed by their time
+            column and time slots without row are missing
+        """
+        day = (date - self.start).days
+        if day < 0:
+            raise AmedasError(f"{date} is before archive start {self.start}")
+        cells = self.rows * self.ncols
+        values = array("f", [math.nan] * cells)
+        flags = bytearray([FLAG_MISSING]) * cells
+        for row in table:
+            r = row_slot(row[0], self.dtype) if row else None
+            if r is None:
+                continue
+            for c, cell in enumerate(row[1:self.ncols + 1]):
+                if self.kinds[c] == "dir":
+                    v, q = parse_direction(cell)
+                else:
+                    v, q = parse_value(cell)
+                if v is not None:
+                    values[r * self.ncols + c] = v
+                flags[r * self.ncols + c] = q
+        self.__pad(day)
+        self.__values.seek(day * cells * 4)
+        self.__values.write(values.tobytes())
+        self.__flags.seek(day * cells)
+        self.__flags.write(flags)
+
+    def close(self) -> None:
+        self.__values.close()
+        self.__flags.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ObsArchive():
+    """Memory-mapped reader of archive
+
+    Slices are views on the mapped pages, nothing is copied and
+    other processes reading the same file share the OS page cache.
+    """
+    def __init__(self, root: str, block_no: str, dtype: AmedasDataType) -> None:
+        self.stem = archive_stem(root, block_no, dtype)
+        with open(self.stem.with_suffix(".json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.dtype = dtype
+        self.columns: typing.List[str] = self.meta["columns"]
+        self.start = datetime.datetime.strptime(self.meta["start"], "%Y%m%d").date()
+        self.rows = self.meta["rows_per_day"]
+        self.ncols = len(self.columns)
+        self.__files = []
+        self.__values = self.__map(".f32")
+        self.__flags = self.__map(".q8")
+        self.ndays = len(self.__flags) // (self.rows * self.ncols) if self.__flags is not None else 0
+
+    def __map(self, suffix: str) -> typing.Optional[mmap.mmap]:
+        f = open(self.stem.with_suffix(suffix), "rb")
+        self.__files.append(f)
+        if f.seek(0, 2) == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __range(self, start: typing.Optional[datetime.date], end: typing.Optional[datetime.date]) -> typing.Tuple[int, int]:
+        a = 0 if start is None else max(0, (start - self.start).days)
+        b = self.ndays if end is None else min(self.ndays, (end - self.start).days)
+        return a, max(a, b)
+
+    def __view(self, buf: typing.Optional[mmap.mmap], itemsize: int, fmt: str, start, end):
+        a, b = self.__range(start, end)
+        cells = self.rows * self.ncols
+        if buf is None or a == b:
+            if np is not None:
+                return np.empty((0, self.rows, self.ncols), dtype=np.float32 if fmt == "f" else np.uint8)
+            return memoryview(bytes()).cast(fmt)
+        if np is not None:
+            return np.frombuffer(buf, dtype=np.float32 if fmt == "f" else np.uint8, count=(b - a) * cells, offset=a * cells * itemsize).reshape(b - a, self.rows, self.ncols)
+        return memoryview(buf)[a * cells * itemsize:b * cells * itemsize].cast(fmt, [b - a, self.rows, self.ncols])
+
+    def values(self, start: typing.Optional[datetime.date] = None, end: typing.Optional[datetime.date] = None):
+        """Observation values of days [start, end)
+
+        Parameters
+        ----------
+        start : typing.Optional[datetime.date], optional
+            first date, by default archive start
+        end : typing.Optional[datetime.date], optional
+            end date (exclusive), by default archive end
+
+        Returns
+        -------
+        numpy.ndarray or memoryview
+            float32 [day][row][column] read-only view, memoryview if numpy is not installed
+        """
+        return self.__view(self.__values, 4, "f", start, end)
+
+    def flags(self, start: typing.Optional[datetime.date] = None, end: typing.Optional[datetime.date] = None):
+        """Quality flags of days [start, end), same shape as values
+        """
+        return self.__view(self.__flags, 1, "B", start, end)
+
+    def column(self, name: str) -> int:
+        return self.columns.index(name)
+
+    def close(self) -> None:
+        for m in (self.__values, self.__flags):
+            if m is not None:
+                try:
+                    m.close()
+                except BufferError:
+                    # views are still alive, closed when collected
+                    pass
+        for f in self.__files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def pack_files(paths: typing.Iterable[Path], root: str) -> int:
+    """Pack per-day csv files saved by save_csv into archives
+
+    Parameters
+    ----------
+    paths : typing.Iterable[Path]
+        csv files "YYYYMMDD_blockno_DTYPE.csv"
+    root : str
+        archive directory
+
+    Returns
+    -------
+    int
+        number of packed days
+    """
+    groups: typing.Dict[typing.Tuple[str, AmedasDataType], typing.List[typing.Tuple[datetime.date, Path]]] = {}
+    for p in paths:
+        date, block_no, dtype = p.stem.split("_", 2)
+        try:
+            key = (block_no, AmedasDataType[dtype])
+            date = datetime.datetime.strptime(date, "%Y%m%d").date()
+        except (KeyError, ValueError):
+            continue
+        if key[1] not in EXPECTED_ROWS:
+            continue
+        groups.setdefault(key, []).append((date, p))
+    n = 0
+    for (block_no, dtype), files in groups.items():
+        files.sort()
+        writer = None
+        for date, p in files:
+            with open(p, newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+            if len(rows) == 0:
+                continue
+            if writer is None:
+                writer = ArchiveWriter(root, block_no, dtype, rows[0], files[0][0])
+            writer.write_day(date, rows[1:])
+            n += 1
+        if writer is not None:
+            writer.close()
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="保存済みの10分値・時間値csvをメモリマップで読める固定長形式にまとめる")
+    parser.add_argument("-o", "--root", type=str, default="./archive", help="出力ディレクトリ")
+    parser.add_argument("src", type=Path, nargs="?", default=Path("./data"), help="csvの保存ディレクトリ")
+    opt = parser.parse_args()
+    n = pack_files(opt.src.rglob("*_*_*.csv"), opt.root)
+    print(f"[Info] {n} days packed")
+    sys.exit(0)
@@ -0,0 +1,338 @@
+from amedasdl_core import AmedasError, ensure_dir
+from amedasdl_adv import AMeDASNode, AmedasDataType, CsvBulkWriter, FileCache, row_timestamp, table_infos
+from pathlib import Path
+import abc
+import datetime
+import json
+import sqlite3
+import threading
+import typing
+
+__author__ = 'customtea (https://github.com/customtea/)'
+__version__ = '1.0.0'
+
+ENTRY_POINT_GROUP = "amedasdl.writers"
+
+writers: typing.Dict[str, type] = {}
+_entry_points_loaded = False
+
+
+def register_writer(name: str):
+    """Class decorator to register output format
+
+    Parameters
+    ----------
+    name : str
+        output format name used by -o / "output"
+    """
+    def deco(cls):
+        cls.name = name
+        writers[name] = cls
+        return cls
+    return deco
+
+
+def load_entry_points() -> None:
+    """Register writers of installed packages
+
+    A package provides a writer class by entry point group "amedasdl.writers",
+    the entry point name is used as output format name.
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            register_writer(ep.name)(ep.load())
+        except Exception as e:
+            print(f"[WARNING] Failed to load writer {ep.name} : {e}")
+
+
+def available_writers() -> typing.List[str]:
+    load_entry_points()
+    return sorted(writers)
+
+
+def writer_class(name: str) -> typing.Optional[type]:
+    """Writer class of output format, None if not supported
+    """
+    if name not in writers:
+        load_entry_points()
+    return writers.get(name)
+
+
+class Page():
+    """One downloaded page, table is parsed once on first use
+    """
+    def __init__(self, node: AMeDASNode, dtype: AmedasDataType, date: datetime.date, html: str) -> None:
+        self.node = node
+        self.dtype = dtype
+        self.date = date
+        self.html = html
+        self.__parsed: typing.Optional[typing.Tuple[typing.List[str], typing.List[typing.List[str]]]] = None
+
+    def __parse(self):
+        if self.__parsed is None:
+            self.__parsed = self.node.parse_page(self.dtype, self.html)
+        return self.__parsed
+
+    @property
+    def header(self) -> typing.List[str]:
+        return self.__parse()[0]
+
+    @property
+    def table(self) -> typing.List[typing.List[str]]:
+        return self.__parse()[1]
+
+    def records(self) -> typing.Iterator[typing.Tuple[datetime.datetime, typing.List[str]]]:
+        """(timestamp, row) of table rows
+        """
+        for row in self.table:
+            if len(row) == 0:
+                continue
+            yield row_timestamp(self.date, row[0]), row
+
+
+class TableWriter(abc.ABC):
+    """Streaming output plugin
+
+    open() once, write_batch() for every page, close() at the end.
+    write_batch() may be called from several threads.
+    """
+    name = ""
+    needs_table = True
+    # writes one file for the whole run, pages must share one opened writer
+    per_run = False
+
+    def __init__(self, **options) -> None:
+        self.options = options
+
+    def open(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def write_batch(self, page: Page) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+@register_writer("csv")
+class CsvWriter(TableWriter):
+    """csv file per station-day, same as save_csv
+    """
+    def write_batch(self, page: Page) -> None:
+        page.node.write_csv(page.dtype, page.date, page.header, page.table)
+
+
+@register_writer("html")
+class HtmlWriter(TableWriter):
+    """raw HTML file per station-day, same as save_html
+    """
+    needs_table = False
+
+    def write_batch(self, page: Page) -> None:
+        page.node.write_html(page.dtype, page.date, page.html)
+
+
+@register_writer("csvbulk")
+class CsvBulkTableWriter(TableWriter):
+    """consolidated csv, options: label, gzip, flush, max_open
+    """
+    per_run = True
+
+    def open(self) -> None:
+        self.bulk = CsvBulkWriter(self.options.get("label", "bulk"), compress=self.options.get("gzip", False), flush_rows=self.options.get("flush", 0), max_open=self.options.get("max_open", 64))
+
+    def write_batch(self, page: Page) -> None:
+        self.bulk.write(page.node, page.dtype, page.date, page.header, page.table)
+
+    def close(self) -> None:
+        self.bulk.close()
+
+
+class _PerFileWriter(TableWriter):
+    """one output file per station and dtype, options: label, max_open
+
+    At most max_open files are kept open, same as CsvBulkWriter.
+    """
+    suffix = ""
+    per_run = True
+
+    def open(self) -> None:
+        self.lock = threading.Lock()
+        self.files = FileCache(self.open_file, lambda f: f.close(), self.options.get("max_open", 64))
+
+    def gen_filepath(self, page: Page) -> Path:
+        return page.node.gen_rootpath() / f"{page.node.block_no}_{page.dtype.name}_{self.options.get('label', 'data')}{self.suffix}"
+
+    @abc.abstractmethod
+    def open_file(self, path: Path, reopen: bool, *args) -> typing.Any:
+        """open output file, reopen is True after it was closed by max_open
+        """
+
+    def close(self) -> None:
+        with self.lock:
+            self.files.close()
+
+
+@register_writer("jsonl")
+class JsonlWriter(_PerFileWriter):
+    """JSON Lines, one observation time per line
+    """
+    suffix = ".jsonl"
+
+    def write_batch(self, page: Page) -> None:
+        header = page.header
+        lines = []
+        for ts, row in page.records():
+            rec = {"oid": f"{page.node.prec_no}{page.node.block_no}", "dtype": page.dtype.name, "日時": ts.strftime("%Y-%m-%d %H:%M")}
+            rec.update(zip(header, row))
+            lines.append(json.dumps(rec, ensure_ascii=False) + "\n")
+        with self.lock:
+            self.files.get(self.gen_filepath(page)).writelines(lines)
+
+    def open_file(self, path: Path, reopen: bool, *args) -> typing.Any:
+        # truncate on first open in this run, append after reopen
+        return open(path, "a" if reopen else "w", encoding="utf-8")
+
+
+@register_writer("parquet")
+class ParquetWriter(_PerFileWriter):
+    """Parquet, one row group per page, needs pyarrow
+
+    A file closed by max_open continues in "{name}.1.parquet", "{name}.2.parquet", ...
+    """
+    suffix = ".parquet"
+
+    def open(self) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise AmedasError("install pyarrow with pip for parquet output")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.parts: typing.Dict[Path, int] = {}
+        super().open()
+
+    def write_batch(self, page: Page) -> None:
+        names = ["日時"] + page.header
+        columns: typing.List[typing.List[str]] = [[] for _ in names]
+        for ts, row in page.records():
+            cells = [ts.strftime("%Y-%m-%d %H:%M")] + row
+            for i in range(len(names)):
+                columns[i].append(cells[i] if i < len(cells) else "")
+        # every column is string, an empty page would infer null type and break the file schema
+        schema = self.pa.schema([(n, self.pa.string()) for n in names])
+        table = self.pa.table(dict(zip(names, columns)), schema=schema)
+        with self.lock:
+            self.files.get(self.gen_filepath(page), schema).write_table(table)
+
+    def open_file(self, path: Path, reopen: bool, *args) -> typing.Any:
+        # closed parquet can not be appended, continue in next part file
+        if reopen:
+            self.parts[path] = self.parts.get(path, 0) + 1
+            path = path.with_name(f"{path.stem}.{self.parts[path]}{path.suffix}")
+        return self.pq.ParquetWriter(str(path), args[0])
+
+
+@register_writer("sqlite")
+class SqliteWriter(TableWriter):
+    """SQLite database, options: path (default ./data/amedas.sqlite)
+    """
+    def open(self) -> None:
+        path = Path(self.options.get("path", "./data/amedas.sqlite"))
+        ensure_dir(path.parent)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS observation (oid TEXT, dtype TEXT, time TEXT, data TEXT, PRIMARY KEY (oid, dtype, time))")
+
+    def write_batch(self, page: Page) -> None:
+        oid = f"{page.node.prec_no}{page.node.block_no}"
+        header = page.header
+        rows = [(oid, page.dtype.name, ts.strftime("%Y-%m-%d %H:%M"), json.dumps(dict(zip(header, row)), ensure_ascii=False)) for ts, row in page.records()]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO observation VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class WriterSet():
+    """Writers opened on first use and shared by every page
+    """
+    def __init__(self, options: typing.Optional[typing.Dict[str, dict]] = None) -> None:
+        """
+        Parameters
+        ----------
+        options : typing.Optional[typing.Dict[str, dict]], optional
+            options per output format name, by default None
+        """
+        self.options = options or {}
+        self.opened: typing.Dict[str, TableWriter] = {}
+        self.unsupported: typing.Set[str] = set()
+        self.__lock = threading.Lock()
+
+    def get(self, name: str) -> typing.Optional[TableWriter]:
+        """Opened writer of format, None if not supported
+        """
+        w = self.opened.get(name)
+        if w is not None or name in self.unsupported:
+            return w
+        with self.__lock:
+            w = self.opened.get(name)
+            if w is None and name not in self.unsupported:
+                cls = writer_class(name)
+                if cls is None:
+                    print(f"Not Support Output Format {name}")
+                    self.unsupported.add(name)
+                    return None
+                w = cls(**self.options.get(name, {}))
+                w.open()
+                self.opened[name] = w
+        return w
+
+    def close(self) -> None:
+        for w in self.opened.values():
+            w.close()
+        self.opened.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_page(node: AMeDASNode, dtype: AmedasDataType, date: datetime.date, outputs: typing.Iterable[str], writer_set: WriterSet) -> None:
+    """Download one page once and write to every output format
+
+    Parameters
+    ----------
+    node : AMeDASNode
+        node
+    dtype : AmedasDataType
+        Data Type
+    date : datetime.date
+        Target Date
+    outputs : typing.Iterable[str]
+        output format names
+    writer_set : WriterSet
+        opened writers
+    """
+    targets = [w for w in (writer_set.get(o) for o in outputs) if w is not None]
+    if dtype not in table_infos:
+        for w in targets:
+            if w.needs_table:
+                print(f"Not Support {dtype.name} for {w.name} output")
+        targets = [w for w in targets if not w.needs_table]
+    if not targets:
+        return
+    page = Page(node, dtype, date, node.download(dtype, date))
+    for w in targets:
+        w.write_batch(page)
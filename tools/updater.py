@@ -1,20 +1,24 @@
-import requests
-import time
+import argparse
+import sys
 from bs4 import BeautifulSoup
 import urllib.parse
 import json
 from parse_node import ObsPoint, parse_node_html
 from pathlib import Path
+import os
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import amedasdl_core
+
+JMA_HOST = os.environ.get("AMEDAS_JMA_HOST", "https://www.data.jma.go.jp")
 
 
 def get_group(key):
-    BASEURL = "https://www.data.jma.go.jp/obd/stats/etrn/select/prefecture.php?prec_no="
+    BASEURL = JMA_HOST + "/obd/stats/etrn/select/prefecture.php?prec_no="
     url = BASEURL + key
     print(url)
-    response = requests.get(url)
-    time.sleep(1)
-    response.encoding = "utf-8"
-    html = response.text
+    # same transport and rate limit as amedasdl, can be recorded and replayed
+    html = amedasdl_core.fetch(url)
     return html
 
 def parse_group_html(html):
@@ -34,11 +38,8 @@ def parse_group_html(html):
 
 
 def stage1():
-    ALLGROUP = "https://www.data.jma.go.jp/obd/stats/etrn/select/prefecture00.php"
-    response = requests.get(ALLGROUP)
-    time.sleep(1)
-    response.encoding = "utf-8"
-    html = response.text
+    ALLGROUP = JMA_HOST + "/obd/stats/etrn/select/prefecture00.php"
+    html = amedasdl_core.fetch(ALLGROUP)
 
     with open("all_group.html", "w") as f:
         f.write(html)
@@ -82,6 +83,9 @@ def stage4(group_d):
         f.write("amedas_json = ")
         f.write(json.dumps(td, ensure_ascii=False))
 
+    # per prec_no shards read by amedasdl_core
+    amedasdl_core.write_registry(td, Path("amedas_registry"))
+
 def update_all():
     print("STAGE1 -- Get group List --")
     html = stage1()
@@ -94,4 +98,15 @@ def update_all():
     print("Update Complete")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="観測所一覧を取得して amedas.json を更新する")
+    record_group = parser.add_mutually_exclusive_group()
+    record_group.add_argument('--record', type=str, default=None, help="取得したページを記録するディレクトリ")
+    record_group.add_argument('--replay', type=str, default=None, help="記録したページを読み込むディレクトリ（アクセスしない）")
+    opt = parser.parse_args()
+    if opt.record or opt.replay:
+        import amedasdl_replay
+        if opt.record:
+            amedasdl_replay.install(amedasdl_replay.RecordTransport(opt.record))
+        else:
+            amedasdl_replay.install(amedasdl_replay.ReplayTransport(opt.replay))
     update_all()
\ No newline at end of file